@@ -1,37 +1,125 @@
 from __future__ import annotations
 
+import codecs
+import json
+import mimetypes
+import time
 from contextlib import contextmanager
+from dataclasses import asdict
 from itertools import zip_longest
 from pathlib import Path
-from typing import Any
-import json
+from typing import Any, AsyncIterator
 
-from fastapi import FastAPI, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Form, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from catalog import get_catalog, get_screen_record
 from common import (
     FIGMA_DIR,
+    LOG_FILE,
     MODEL_DIR_MAPPING,
     MODEL_FILE_MAPPING,
-    get_latest_test_report_url,
     get_logger,
     get_ocr_results,
-    get_screen_text_content,
+    get_visual_results,
+    map_models,
+)
+from json_stream import TranslationParser
+from metrics import (
+    CACHE_REQUESTS,
+    CONTENT_TYPE,
+    DATA_PREP_DURATION,
+    REQUEST_DURATION,
+    TEMPLATE_RENDER_DURATION,
+    render_metrics,
+)
+from mirror import MIRROR_ROUTE, get_mirror
+from screens import load_screens
+from text_preview import get_preview_data_uri, render_preview_png
+from validate_strings import (
+    MissingRuleError,
+    TooLong,
+    check_translation,
+    check_translations,
+    get_en_content,
+    get_layout,
+    get_rules_content,
 )
-from validate_strings import check_translations, TooLong
 
 HERE = Path(__file__).parent
 
-log_file_path = HERE / "app.log"
-logger = get_logger(__name__, log_file_path)
+logger = get_logger(__name__, LOG_FILE)
 
 app = FastAPI()
 
-app.mount("/static", StaticFiles(directory=FIGMA_DIR.name), name=FIGMA_DIR.name)
+app.mount("/static", StaticFiles(directory=FIGMA_DIR), name=FIGMA_DIR.name)
+
+templates = Jinja2Templates(directory=HERE / "templates")
+
+templates.env.globals["preview"] = get_preview_data_uri
+
+CACHE_REQUESTS.watch_lru_cache("layout", get_layout)
+CACHE_REQUESTS.watch_lru_cache("preview", render_preview_png)
+
+
+def get_route_path(scope: Scope) -> str:
+    """Get the path template of the matched route, e.g. `/flow/{model}/{flow_name}`."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unknown")
+    return "unmatched"
+
+
+class RequestDurationMiddleware:
+    """Measures the whole request, including streamed responses.
+
+    Plain ASGI middleware, so that it does not interfere
+    with streaming of the request body.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        # Before handling the request - mounted apps rewrite the path in the scope
+        route = get_route_path(scope)
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=route,
+                status=str(status),
+            )
+
+
+app.add_middleware(RequestDurationMiddleware)
 
-templates = Jinja2Templates(directory="templates")
+
+def render_template(name: str, context: dict[str, Any]) -> Response:
+    with TEMPLATE_RENDER_DURATION.time(template=name):
+        return templates.TemplateResponse(name, context)  # type: ignore
 
 
 def get_subdirs_names(dir: Path) -> list[str]:
@@ -49,63 +137,45 @@ def get_relevant_screens(
     filter_flow: str | None = None,
     filter_text: str | None = None,
 ) -> list[dict[str, Any]]:
-    file = MODEL_FILE_MAPPING.get(model)
-    if not file:
+    with DATA_PREP_DURATION.time(function="get_relevant_screens"):
+        return _get_relevant_screens(model, filter_flow, filter_text)
+
+
+def _get_relevant_screens(
+    model: str,
+    filter_flow: str | None,
+    filter_text: str | None,
+) -> list[dict[str, Any]]:
+    if model not in MODEL_FILE_MAPPING:
         raise HTTPException(status_code=404, detail="Model not found")
 
-    screens_content = get_screen_text_content(file)
+    catalog = get_catalog()
+    if catalog is not None:
+        records = catalog.get_screens(model, filter_flow, filter_text)
+        if records is not None:
+            return records
+
     image_data: list[dict[str, Any]] = []
 
-    ocr_results = get_ocr_results()
+    ocr_results = get_ocr_results().get(model, {})
+    visual_results = get_visual_results().get(model, {})
+    text = filter_text.lower() if filter_text else None
+    mirror = get_mirror()
 
-    for flow_name, flow_data in screens_content.items():
-        if filter_flow and flow_name != filter_flow:
+    for screen in load_screens(model):
+        if filter_flow and screen.flow_name != filter_flow:
             continue  # filter by flow
-        for index, screen_info in enumerate(flow_data, start=1):
-            description = screen_info["description"]
-            if filter_text and filter_text.lower() not in description.lower():
-                continue  # filter by text
-            comment = screen_info.get("comment", "")
-            img_name = f"{flow_name}{index}"
-            img_src = f"/static/{model}/{flow_name}/{img_name}.png"
-            ocr_result = ocr_results.get(flow_name, {}).get(img_name, 0)
-            ocr_result_str = f"{ocr_result} %"
-            ocr_failed = ocr_result < 20
-            if screen_info.get("ok_to_fail_ocr", False):
-                ocr_result_str = f"{ocr_result_str} (OK to fail)"
-                ocr_failed = False
-
-            test = screen_info["test"]
-            screen_id = screen_info["screen_id"]
-            test_link = get_latest_test_report_url(test)
-            test_link = f"{test_link}#{screen_id}"
-
-            image_data.append(
-                {
-                    "test_link": test_link,
-                    "name": img_name,
-                    "compare_index": screen_info.get("compare_index"),
-                    "src": img_src,
-                    "description": description,
-                    "comment": comment,
-                    "ocr_result_str": ocr_result_str,
-                    "ocr_failed": ocr_failed,
-                }
-            )
+        if text and text not in screen.description.lower():
+            continue  # filter by text
+        image_data.append(
+            get_screen_record(screen, ocr_results, visual_results, mirror)
+        )
 
     return image_data
 
 
-def get_unique_tests_and_links(model: str, flow_name: str) -> dict[str, str]:
-    file = MODEL_FILE_MAPPING.get(model)
-    if not file:
-        raise HTTPException(status_code=404, detail="Model not found")
-    screens_content = get_screen_text_content(file)
-    flow_data: list[dict[str, str]] = screens_content[flow_name]
-    return {
-        screen_info["test"]: get_latest_test_report_url(screen_info["test"])
-        for screen_info in flow_data
-    }
+def get_unique_tests_and_links(image_data: list[dict[str, Any]]) -> dict[str, str]:
+    return {screen["test"]: screen["test_url"] for screen in image_data}
 
 
 @contextmanager
@@ -123,7 +193,7 @@ def root(request: Request):
         logger.info("Root")
 
         models = list(MODEL_DIR_MAPPING.keys())
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "index.html",
             {"request": request, "models": models},
         )
@@ -143,7 +213,7 @@ def model(model: str, request: Request):
             (subdir, get_dir_file_count(dir / subdir)) for subdir in subdirs
         ]
         model_infos[model] = subdirs_and_filecounts
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "model_menu.html",
             {"request": request, "model_infos": model_infos},
         )
@@ -154,7 +224,7 @@ def all_screens(model: str, request: Request):
     with catch_log_raise_exception():
         logger.info("All screens")
         image_data = get_relevant_screens(model)
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "all_screens.html",
             {
                 "request": request,
@@ -174,9 +244,9 @@ def read_subdir(model: str, flow_name: str, request: Request):
             raise HTTPException(status_code=404, detail="Directory not found")
 
         image_data = get_relevant_screens(model, filter_flow=flow_name)
-        unique_tests_and_links = get_unique_tests_and_links(model, flow_name)
+        unique_tests_and_links = get_unique_tests_and_links(image_data)
 
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "flow.html",
             {
                 "request": request,
@@ -193,12 +263,17 @@ def compare_subdir(flow_name: str, request: Request):
         logger.info(f"Compare, Flow: {flow_name}")
         all_model_image_data: dict[str, list[dict[str, Any]]] = {}
 
+        def get_model_image_data(model: str) -> list[dict[str, Any]] | None:
+            if flow_name not in get_subdirs_names(MODEL_DIR_MAPPING[model]):
+                return None
+            return get_relevant_screens(model, filter_flow=flow_name)
+
         all_unique_indexes: set[int] = set()
-        for model, dir in MODEL_DIR_MAPPING.items():
-            if flow_name not in get_subdirs_names(dir):
+        models = list(MODEL_DIR_MAPPING)
+        for model, image_data in zip(models, map_models(get_model_image_data, models)):
+            if image_data is None:
                 continue
 
-            image_data = get_relevant_screens(model, filter_flow=flow_name)
             for obj in image_data:
                 all_unique_indexes.add(obj.get("compare_index", 0))
             all_model_image_data[model] = image_data
@@ -222,7 +297,7 @@ def compare_subdir(flow_name: str, request: Request):
             for el in zip_longest(*index_dict.values()):
                 zipped_image_data.append(el)
 
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "compare_flow.html",
             {
                 "request": request,
@@ -246,13 +321,16 @@ def compare_menu(request: Request):
                         result.update(set1.intersection(set2))
             return result
 
-        for model, dir in MODEL_DIR_MAPPING.items():
-            model_flows = get_subdirs_names(dir)
-            all_model_flows[model] = set(model_flows)
+        models = list(MODEL_DIR_MAPPING)
+        model_flows = map_models(
+            lambda model: get_subdirs_names(MODEL_DIR_MAPPING[model]), models
+        )
+        for model, flows in zip(models, model_flows):
+            all_model_flows[model] = set(flows)
 
         common_flows = find_common_elements(list(all_model_flows.values()))
 
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "compare_menu.html",
             {
                 "request": request,
@@ -266,10 +344,14 @@ def text_search(request: Request, text: str = ""):
     with catch_log_raise_exception():
         logger.info(f"Text search: {text}")
         image_data: list[dict[str, Any]] = []
-        for model in MODEL_DIR_MAPPING:
-            model_data = get_relevant_screens(model, filter_text=text) if text else []
-            image_data.extend(model_data)
-        return templates.TemplateResponse(  # type: ignore
+        if text:
+            model_data = map_models(
+                lambda model: get_relevant_screens(model, filter_text=text),
+                MODEL_DIR_MAPPING,
+            )
+            for data in model_data:
+                image_data.extend(data)
+        return render_template(
             "text_search.html",
             {
                 "request": request,
@@ -279,11 +361,26 @@ def text_search(request: Request, text: str = ""):
         )
 
 
+@app.get(MIRROR_ROUTE + "/{path:path}")
+def mirrored_file(path: str):
+    mirror = get_mirror()
+    content = mirror.read(path) if mirror is not None else None
+    if content is None:
+        raise HTTPException(status_code=404, detail="Not mirrored")
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return Response(content, media_type=media_type)
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
 @app.get("/translations")
 def translations_get(request: Request):
     with catch_log_raise_exception():
         logger.info("Translations HTML")
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "translations.html",
             {
                 "request": request,
@@ -311,7 +408,7 @@ def translations_post(request: Request, text: str = Form(...)):
             except Exception as e:
                 logger.exception(f"Error: {e}")
                 error = str(e)
-        return templates.TemplateResponse(  # type: ignore
+        return render_template(
             "translations.html",
             {
                 "request": request,
@@ -320,3 +417,168 @@ def translations_post(request: Request, text: str = Form(...)):
                 "translations_check": translations_check,
             },
         )
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """Streaming response, which is sent while the request body is still read.
+
+    `StreamingResponse` is listening for the client disconnect in parallel,
+    which would consume the request body messages. Disconnect is detected
+    when reading the body anyway.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+async def iter_multipart_file(request: Request, field: str) -> AsyncIterator[bytes]:
+    """Content of one file field of a multipart body, as the body arrives."""
+    _, params = parse_options_header(request.headers["content-type"])
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing multipart boundary")
+
+    chunks: list[bytes] = []
+    part: dict[str, Any] = {"header": b"", "value": b"", "name": None, "found": False}
+
+    def on_part_begin() -> None:
+        part["name"] = None
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["header"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        if part["header"].lower() == b"content-disposition":
+            _, options = parse_options_header(part["value"])
+            part["name"] = options.get(b"name", b"").decode("latin-1")
+        part["header"] = part["value"] = b""
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if part["name"] == field:
+            part["found"] = True
+            chunks.append(data[start:end])
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_part_data": on_part_data,
+        },
+    )
+    async for body_chunk in request.stream():
+        parser.write(body_chunk)
+        if chunks:
+            yield b"".join(chunks)
+            chunks.clear()
+    parser.finalize()
+    if chunks:
+        yield b"".join(chunks)
+    if not part["found"]:
+        raise ValueError("Missing file")
+
+
+async def iter_request_chunks(request: Request) -> AsyncIterator[bytes]:
+    """Chunks of the uploaded translation file (`file` form field) or raw body.
+
+    Neither is spooled, the chunks are passed on as they arrive.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        async for chunk in iter_multipart_file(request, "file"):
+            yield chunk
+    else:
+        async for chunk in request.stream():
+            yield chunk
+
+
+def check_translation_text(
+    parser: TranslationParser,
+    text: str,
+    en_content: dict[str, str],
+    rules_content: dict[str, str],
+) -> tuple[int, list[dict[str, Any]]]:
+    """Parse the next piece of the file and check all the completed translations."""
+    items = parser.feed(text)
+    events: list[dict[str, Any]] = []
+    for key, value in items:
+        try:
+            too_long = check_translation(key, value, en_content, rules_content)
+        except MissingRuleError as e:
+            events.append({"event": "warning", "key": key, "message": str(e)})
+            continue
+        if too_long is not None:
+            event = {"event": "too_long", **asdict(too_long)}
+            event["lines_str"] = too_long.lines_str()
+            event["lines_en_str"] = too_long.lines_en_str()
+            events.append(event)
+    return len(items), events
+
+
+def format_stream_event(event: dict[str, Any], format: str) -> str:
+    data = json.dumps(event)
+    if format == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return f"{data}\n"
+
+
+@app.post("/translations/stream")
+async def translations_stream(request: Request, format: str = "ndjson"):
+    """Check translations while they are being uploaded, streaming the results.
+
+    Results are sent as NDJSON or server-sent events (`?format=sse`).
+    Each too long translation is one `too_long` event, translations without
+    rules are `warning` events and the stream ends with `done` or `error` event.
+    """
+    logger.info(f"Translations stream, format: {format}")
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unknown format")
+
+    async def generate_events() -> AsyncIterator[str]:
+        parser = TranslationParser()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        en_content = get_en_content()
+        rules_content = get_rules_content()
+        checked = 0
+        too_long = 0
+
+        async def process(text: str) -> list[str]:
+            nonlocal checked, too_long
+            count, events = await run_in_threadpool(
+                check_translation_text, parser, text, en_content, rules_content
+            )
+            checked += count
+            too_long += sum(event["event"] == "too_long" for event in events)
+            return [format_stream_event(event, format) for event in events]
+
+        try:
+            async for chunk in iter_request_chunks(request):
+                for line in await process(decoder.decode(chunk)):
+                    yield line
+            for line in await process(decoder.decode(b"", final=True)):
+                yield line
+            parser.close()
+        except Exception as e:
+            logger.exception(f"Error: {e}")
+            yield format_stream_event({"event": "error", "message": str(e)}, format)
+            return
+        done = {"event": "done", "checked": checked, "too_long": too_long}
+        yield format_stream_event(done, format)
+
+    return RequestStreamingResponse(
+        generate_events(), media_type=STREAM_MEDIA_TYPES[format]
+    )
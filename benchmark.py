@@ -0,0 +1,364 @@
+"""
+Benchmarks of the web routes and the update pipeline on synthetic data.
+
+The data set is generated from the real screen definitions, multiplied
+by a scale factor. The app and `get_screens.py` are run in separate processes
+pointed at the generated data (`FIGMA_UI_DATA_DIR`), the update is talking
+to a local mock server standing in for Gitlab and the test report pages.
+
+Usage:
+    python benchmark.py run --scale 1 --scale 10 --scale 100
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Iterator
+from urllib.parse import unquote, urlparse
+
+import click
+from PIL import Image
+
+from common import HERE, MODEL_FILE_MAPPING, MODEL_SCREEN_SIZES, TEST_CASE_MAPPING
+
+TRANSLATION_FILE = HERE / "de.json"
+
+
+def get_png_bytes(size: tuple[int, int]) -> bytes:
+    img = Image.new("L", size)
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def get_job_id_mapping() -> dict[str, str]:
+    return {
+        job_name: str(1000 + index)
+        for index, job_name in enumerate(TEST_CASE_MAPPING.values())
+    }
+
+
+def generate_data(data_dir: Path, scale: int) -> dict[str, Any]:
+    """Generate the screen definitions, screenshots, OCR results and job mapping.
+
+    Every flow is copied `scale` times, with its tests renamed,
+    so also the number of distinct test reports grows with the scale.
+    """
+    random.seed(scale)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    ocr_results: dict[str, dict[str, dict[str, int]]] = {}
+    screen_count = 0
+
+    for model, file in MODEL_FILE_MAPPING.items():
+        original = json.loads((HERE / file.name).read_text())
+        png_bytes = get_png_bytes(MODEL_SCREEN_SIZES[model])
+        content: dict[str, list[dict[str, Any]]] = {}
+        for copy in range(scale):
+            for flow_name, flow_data in original.items():
+                new_flow_name = flow_name if copy == 0 else f"{flow_name}Copy{copy}"
+                new_flow_data = []
+                for screen_info in flow_data:
+                    screen_info = dict(screen_info)
+                    if copy:
+                        screen_info["test"] = f"{screen_info['test']}-copy{copy}"
+                    new_flow_data.append(screen_info)
+                content[new_flow_name] = new_flow_data
+
+                flow_dir = data_dir / "static" / model / new_flow_name
+                flow_dir.mkdir(parents=True, exist_ok=True)
+                for index in range(1, len(new_flow_data) + 1):
+                    img_name = f"{new_flow_name}{index}"
+                    (flow_dir / f"{img_name}.png").write_bytes(png_bytes)
+                    model_results = ocr_results.setdefault(model, {})
+                    model_results.setdefault(new_flow_name, {})[img_name] = (
+                        random.randint(0, 100)
+                    )
+                    screen_count += 1
+        (data_dir / file.name).write_text(json.dumps(content, indent=4))
+
+    (data_dir / "ocr_results.json").write_text(json.dumps(ocr_results))
+    (data_dir / "job_id_mapping.json").write_text(json.dumps(get_job_id_mapping()))
+
+    return {"scale": scale, "screens": screen_count}
+
+
+def percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def run_measured(cmd: list[str], env: dict[str, str]) -> tuple[float, int, str]:
+    """Run a command, return its elapsed time, peak RSS in kB and stdout."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, env=env, cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    assert process.stdout is not None
+    stdout = process.stdout.read().decode()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed with {process.returncode}")
+    return elapsed, rusage.ru_maxrss, stdout
+
+
+def get_env(data_dir: Path, **extra: str) -> dict[str, str]:
+    return {**os.environ, "FIGMA_UI_DATA_DIR": str(data_dir), **extra}
+
+
+def get_route_urls(data_dir: Path) -> Iterator[tuple[str, str]]:
+    """Yield (route, url) pairs to request, one of each route."""
+    flows = {
+        model: list(json.loads((data_dir / file.name).read_text()))
+        for model, file in MODEL_FILE_MAPPING.items()
+    }
+    first_flows = next(iter(flows.values()))
+    common_flow = next(
+        (flow for flow in first_flows if all(flow in f for f in flows.values())),
+        first_flows[0],
+    )
+    for model, model_flows in flows.items():
+        yield "/all_screens/{model}", f"/all_screens/{model}"
+        yield "/flow/{model}/{flow_name}", f"/flow/{model}/{model_flows[0]}"
+    yield "/compare/{flow_name}", f"/compare/{common_flow}"
+    yield "/text", "/text?text=wallet"
+    yield "/translations", "/translations"
+
+
+def bench_routes(requests: int) -> dict[str, dict[str, float]]:
+    """Drive the app routes through the ASGI test client.
+
+    Expects `FIGMA_UI_DATA_DIR` to be already set, as it is read on import.
+    """
+    from fastapi.testclient import TestClient
+
+    from app import app
+
+    client = TestClient(app)
+    data_dir = Path(os.environ["FIGMA_UI_DATA_DIR"])
+    translations = TRANSLATION_FILE.read_text()
+
+    results: dict[str, dict[str, float]] = {}
+    calls: list[tuple[str, Any]] = [
+        (route, lambda url=url: client.get(url))
+        for route, url in get_route_urls(data_dir)
+    ]
+    calls.append(
+        (
+            "POST /translations",
+            lambda: client.post("/translations", data={"text": translations}),
+        )
+    )
+    for route, call in calls:
+        call()  # warm-up
+        latencies: list[float] = []
+        start = time.perf_counter()
+        for _ in range(requests):
+            request_start = time.perf_counter()
+            response = call()
+            latencies.append(time.perf_counter() - request_start)
+            response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        # Keeping the worst result of the same route template (e.g. both models)
+        summary = summarize(latencies, elapsed)
+        if route not in results or results[route]["p50_ms"] < summary["p50_ms"]:
+            results[route] = summary
+    return results
+
+
+class MockGitlabHandler(BaseHTTPRequestHandler):
+    """Serves the Gitlab API and the test report pages with images."""
+
+    png_bytes = b""
+    # Highest screen id shown on each test report page
+    max_screen_id = 0
+    arrivals: list[float] = []
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, content: bytes, content_type: str) -> None:
+        self.arrivals.append(time.perf_counter())
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        path = unquote(urlparse(self.path).path)
+        if path.endswith("/pipelines.json"):
+            pipelines = [{"ref": {"name": "main"}, "iid": 1}]
+            self._send(
+                json.dumps({"pipelines": pipelines}).encode(), "application/json"
+            )
+        elif path.endswith(".html"):
+            imgs = "\n".join(
+                f'<img id="{i}" class="screen" src="../img/{i}.png">'
+                for i in range(self.max_screen_id + 1)
+            )
+            self._send(f"<html><body>{imgs}</body></html>".encode(), "text/html")
+        elif re.search(r"/img/\d+\.png$", path):
+            self._send(self.png_bytes, "image/png")
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        jobs = [
+            {"id": f"gid://gitlab/Ci::Build/{job_id}", "name": name}
+            for name, job_id in get_job_id_mapping().items()
+        ]
+        stages = {"nodes": [{"groups": {"nodes": [{"jobs": {"nodes": jobs}}]}}]}
+        content = {"data": {"project": {"pipeline": {"stages": stages}}}}
+        self._send(json.dumps(content).encode(), "application/json")
+
+
+def bench_update(data_dir: Path) -> dict[str, Any]:
+    """Run `get_screens.py` for all models against the mock server.
+
+    Then the reports are mirrored and all models are rebuilt from the mirror
+    with the server shut down.
+    """
+    MockGitlabHandler.png_bytes = get_png_bytes(next(iter(MODEL_SCREEN_SIZES.values())))
+    MockGitlabHandler.max_screen_id = max(
+        int(screen_info["screen_id"])
+        for file in MODEL_FILE_MAPPING.values()
+        for flow_data in json.loads((data_dir / file.name).read_text()).values()
+        for screen_info in flow_data
+    )
+    MockGitlabHandler.arrivals = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockGitlabHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    env = get_env(data_dir, FIGMA_UI_GITLAB_URL=url, FIGMA_UI_REPORTS_URL=url)
+
+    def measure_run(elapsed: float, max_rss: int) -> dict[str, Any]:
+        return {"elapsed_s": round(elapsed, 2), "peak_rss_mb": round(max_rss / 1024, 1)}
+
+    def summarize_run(elapsed: float, max_rss: int) -> dict[str, Any]:
+        arrivals = MockGitlabHandler.arrivals
+        # Time between consecutive requests = client time per request
+        gaps = [b - a for a, b in zip(arrivals, arrivals[1:])] or [elapsed]
+        summary: dict[str, Any] = summarize(gaps, elapsed)
+        summary["requests"] = len(arrivals)
+        summary["throughput_rps"] = round(len(arrivals) / elapsed, 2)
+        summary.update(measure_run(elapsed, max_rss))
+        return summary
+
+    results: dict[str, Any] = {}
+    try:
+        for model in MODEL_FILE_MAPPING:
+            MockGitlabHandler.arrivals.clear()
+            cmd = [sys.executable, "get_screens.py", model]
+            results[model] = summarize_run(*run_measured(cmd, env)[:2])
+
+        MockGitlabHandler.arrivals.clear()
+        cmd = [sys.executable, "mirror.py"]
+        results["mirror"] = summarize_run(*run_measured(cmd, env)[:2])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # The server is down, all the screens have to come from the mirror
+    cmd = [sys.executable, "get_screens.py", "--mirror"]
+    results["offline"] = measure_run(*run_measured(cmd, env)[:2])
+    return results
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("data_dir", type=click.Path(path_type=Path))
+@click.option("-s", "--scale", default=1, help="How many times to multiply the data")
+def generate(data_dir: Path, scale: int):
+    """Generate the synthetic data set."""
+    click.echo(json.dumps(generate_data(data_dir, scale)))
+
+
+@cli.command()
+@click.option("-n", "--requests", default=20, help="Requests per route")
+def routes(requests: int):
+    """Benchmark the routes on data in FIGMA_UI_DATA_DIR."""
+    click.echo(json.dumps(bench_routes(requests)))
+
+
+@cli.command()
+# fmt: off
+@click.option("-s", "--scale", "scales", multiple=True, type=int, default=[1, 10, 100], help="Data scales to run")
+@click.option("-n", "--requests", default=20, help="Requests per route")
+@click.option("-c", "--catalog", is_flag=True, help="Build the screen catalog first")
+@click.option("-o", "--output", type=click.Path(path_type=Path), help="Save the results as JSON")
+# fmt: on
+def run(scales: list[int], requests: int, catalog: bool, output: Path | None):
+    """Generate the data and run all the benchmarks for each scale."""
+    all_results: list[dict[str, Any]] = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = Path(tmp_dir)
+            result = generate_data(data_dir, scale)
+            click.echo(f"Scale {scale}x - {result['screens']} screens")
+            env = get_env(data_dir)
+
+            if catalog:
+                run_measured([sys.executable, "catalog.py"], env)
+
+            cmd = [sys.executable, "benchmark.py", "routes", "-n", str(requests)]
+            _, max_rss, stdout = run_measured(cmd, env)
+            result["routes"] = json.loads(stdout)
+            result["routes_peak_rss_mb"] = round(max_rss / 1024, 1)
+            for route, summary in result["routes"].items():
+                click.echo(f"  {route:<28} {format_summary(summary)}")
+            click.echo(f"  routes peak RSS: {result['routes_peak_rss_mb']} MB")
+
+            result["update"] = bench_update(data_dir)
+            for model, summary in result["update"].items():
+                # Runs with no requests (offline) only have the time and memory
+                stats = f"{format_summary(summary)} " if "p50_ms" in summary else ""
+                click.echo(
+                    f"  update {model:<21} {stats}"
+                    f"{summary['elapsed_s']} s, peak RSS: {summary['peak_rss_mb']} MB"
+                )
+            all_results.append(result)
+
+    if output:
+        output.write_text(json.dumps(all_results, indent=2))
+
+
+def format_summary(summary: dict[str, float]) -> str:
+    return (
+        f"{summary['throughput_rps']:>9} req/s"
+        f" p50 {summary['p50_ms']:>9} ms"
+        f" p99 {summary['p99_ms']:>9} ms"
+    )
+
+
+if __name__ == "__main__":
+    cli()
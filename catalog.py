@@ -0,0 +1,317 @@
+"""
+Read-only screen catalog shared between the app workers.
+
+The screen definitions, OCR and visual match results and test report links of all models
+are compiled into one binary file. Every worker memory-maps it, so the data
+is loaded lazily, only the requested screens are decoded and the pages are
+shared between the processes by the OS.
+
+Layout of the file (all integers are little-endian uint32):
+
+    MAGIC | VERSION | HEADER_LEN | HEADER (JSON) | DATA
+
+The small header describes, for each model, where its sections live in DATA:
+- `offsets` - array of N + 1 record offsets (record i is offsets[i]:offsets[i+1])
+- `records` - concatenated JSON-encoded screen records
+- `search_offsets` - array of N + 1 offsets into the search blob
+- `search` - concatenated lowercased descriptions, separated by a zero byte
+- `flows` - mapping of flow name to its [start, end) record index range
+
+Text search is done by `mmap.find` directly over the search blob.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Iterator
+
+from common import (
+    DATA_DIR,
+    JOB_ID_MAPPING_FILE,
+    MIRROR_FILE,
+    MODEL_FILE_MAPPING,
+    OCR_RESULTS_FILE,
+    VISUAL_RESULTS_FILE,
+    get_ocr_results,
+    get_visual_results,
+)
+from metrics import record_cache_lookup
+from mirror import Mirror, get_mirror
+from models import MODELS_FILE
+from screens import Screen, load_screens
+
+CATALOG_FILE = DATA_DIR / "catalog.bin"
+
+MAGIC = b"FIGMACAT"
+VERSION = 2
+PREFIX = struct.Struct("<8sII")
+SEARCH_SEPARATOR = b"\x00"
+
+# Visual match score (in %) below which the screen is highlighted
+VISUAL_MATCH_THRESHOLD = 80
+
+
+def get_catalog_sources() -> list[Path]:
+    """All the files the catalog is compiled from."""
+    return [
+        MODELS_FILE,
+        *MODEL_FILE_MAPPING.values(),
+        OCR_RESULTS_FILE,
+        VISUAL_RESULTS_FILE,
+        JOB_ID_MAPPING_FILE,
+        MIRROR_FILE,
+    ]
+
+
+def get_sources_stamp() -> dict[str, int]:
+    """Modification times of the sources, 0 for the missing ones."""
+    return {str(source): _get_mtime(source) for source in get_catalog_sources()}
+
+
+def get_screen_record(
+    screen: Screen,
+    ocr_results: dict[str, dict[str, int]],
+    visual_results: dict[str, dict[str, int]],
+    mirror: Mirror | None = None,
+) -> dict[str, Any]:
+    """Assemble all the data about one screen, as shown on the website.
+
+    Test reports are linked to the mirror, when they are mirrored.
+    """
+    flow_name = screen.flow_name
+    img_name = screen.name
+    ocr_result = ocr_results.get(flow_name, {}).get(img_name, 0)
+    ocr_result_str = f"{ocr_result} %"
+    ocr_failed = ocr_result < 20
+    if screen.ok_to_fail_ocr:
+        ocr_result_str = f"{ocr_result_str} (OK to fail)"
+        ocr_failed = False
+
+    # Screens without Figma reference have no visual score
+    visual_result = visual_results.get(flow_name, {}).get(img_name)
+    visual_result_str = "-" if visual_result is None else f"{visual_result} %"
+    visual_failed = visual_result is not None and visual_result < VISUAL_MATCH_THRESHOLD
+
+    test_url = screen.test_url
+    if mirror is not None:
+        test_url = mirror.get_link(test_url)
+
+    return {
+        "test": screen.test,
+        "test_url": test_url,
+        "test_link": f"{test_url}#{screen.screen_id}",
+        "name": img_name,
+        "compare_index": screen.compare_index,
+        "src": screen.img_src,
+        "description": screen.description,
+        "comment": screen.comment,
+        "ocr_result_str": ocr_result_str,
+        "ocr_failed": ocr_failed,
+        "visual_result_str": visual_result_str,
+        "visual_failed": visual_failed,
+    }
+
+
+def iter_model_records(model: str) -> Iterator[tuple[str, dict[str, Any]]]:
+    """Yield (flow_name, record) for all the screens of a model."""
+    ocr_results = get_ocr_results().get(model, {})
+    visual_results = get_visual_results().get(model, {})
+    mirror = get_mirror()
+    for screen in load_screens(model):
+        record = get_screen_record(screen, ocr_results, visual_results, mirror)
+        yield screen.flow_name, record
+
+
+def _pack_offsets(offsets: list[int]) -> bytes:
+    return struct.pack(f"<{len(offsets)}I", *offsets)
+
+
+def build_catalog(path: Path = CATALOG_FILE) -> None:
+    """Compile the catalog and atomically replace the old one.
+
+    Workers which have the old file mapped keep using it until they notice
+    the change, so the update is safe to do while the app is running.
+    """
+    data = bytearray()
+    # Taken before reading the sources, so the changes made meanwhile are noticed
+    header: dict[str, Any] = {"sources": get_sources_stamp(), "models": {}}
+
+    def add_section(content: bytes) -> list[int]:
+        start = len(data)
+        data.extend(content)
+        return [start, len(content)]
+
+    for model in MODEL_FILE_MAPPING:
+        records = bytearray()
+        offsets = [0]
+        search = bytearray()
+        search_offsets = [0]
+        flows: dict[str, list[int]] = {}
+
+        for index, (flow_name, record) in enumerate(iter_model_records(model)):
+            flows.setdefault(flow_name, [index, index])[1] = index + 1
+
+            records.extend(json.dumps(record).encode())
+            offsets.append(len(records))
+
+            search.extend(record["description"].lower().encode())
+            search.extend(SEARCH_SEPARATOR)
+            search_offsets.append(len(search))
+
+        header["models"][model] = {
+            "flows": flows,
+            "offsets": add_section(_pack_offsets(offsets)),
+            "records": add_section(bytes(records)),
+            "search_offsets": add_section(_pack_offsets(search_offsets)),
+            "search": add_section(bytes(search)),
+        }
+
+    header_bytes = json.dumps(header).encode()
+    # Several builds may be running at once
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ModelCatalog:
+    """Zero-copy view of one model's sections in the mapped file."""
+
+    def __init__(self, buffer: memoryview, data_start: int, info: dict[str, Any]):
+        self.flows: dict[str, list[int]] = info["flows"]
+
+        def section(name: str) -> memoryview:
+            start, length = info[name]
+            start += data_start
+            return buffer[start : start + length]
+
+        self._offsets = section("offsets").cast("I")
+        self._records = section("records")
+        self._search_offsets = section("search_offsets").cast("I")
+        self._search_start = data_start + info["search"][0]
+        self._search_end = self._search_start + info["search"][1]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get_record(self, index: int) -> dict[str, Any]:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return json.loads(self._records[start:end].tobytes())
+
+    def get_records(self, start: int, end: int) -> list[dict[str, Any]]:
+        return [self.get_record(index) for index in range(start, end)]
+
+    def get_flow_records(self, flow_name: str) -> list[dict[str, Any]]:
+        start, end = self.flows.get(flow_name, (0, 0))
+        return self.get_records(start, end)
+
+    def find_indexes(self, mm: mmap.mmap, text: str) -> list[int]:
+        """Indexes of all records whose description contains the text."""
+        needle = text.lower().encode()
+        indexes: list[int] = []
+        pos = mm.find(needle, self._search_start, self._search_end)
+        while pos != -1:
+            relative_pos = pos - self._search_start
+            index = bisect_right(self._search_offsets, relative_pos) - 1
+            # Make sure the match does not span over the separator
+            if relative_pos + len(needle) < self._search_offsets[index + 1]:
+                indexes.append(index)
+            # Continue searching from the next record
+            next_pos = self._search_start + self._search_offsets[index + 1]
+            pos = mm.find(needle, next_pos, self._search_end)
+        return indexes
+
+
+class Catalog:
+    """Memory-mapped catalog of all the models."""
+
+    def __init__(self, path: Path = CATALOG_FILE):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, version, header_len = PREFIX.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported catalog file {path}")
+        header_end = PREFIX.size + header_len
+        header = json.loads(buffer[PREFIX.size : header_end].tobytes())
+        self.sources_stamp: dict[str, int] = header["sources"]
+        self.models = {
+            model: ModelCatalog(buffer, header_end, info)
+            for model, info in header["models"].items()
+        }
+
+    def get_screens(
+        self,
+        model: str,
+        filter_flow: str | None = None,
+        filter_text: str | None = None,
+    ) -> list[dict[str, Any]] | None:
+        """Records of the model's screens, None when the model is not in the catalog."""
+        model_catalog = self.models.get(model)
+        if model_catalog is None:
+            return None
+        if filter_text:
+            indexes = model_catalog.find_indexes(self._mmap, filter_text)
+            if filter_flow:
+                start, end = model_catalog.flows.get(filter_flow, (0, 0))
+                indexes = [i for i in indexes if start <= i < end]
+            return [model_catalog.get_record(i) for i in indexes]
+        if filter_flow:
+            return model_catalog.get_flow_records(filter_flow)
+        return model_catalog.get_records(0, len(model_catalog))
+
+
+_catalog: Catalog | None = None
+_catalog_stamp: tuple[int, int] | None = None
+
+
+def _get_mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def get_catalog() -> Catalog | None:
+    """Get the mapped catalog, if it exists and is up to date.
+
+    Returns None when the catalog was not built or any of its sources
+    was changed, added or removed after that, so the callers can fall back
+    to the sources.
+    """
+    global _catalog, _catalog_stamp
+
+    try:
+        stat = CATALOG_FILE.stat()
+    except FileNotFoundError:
+        record_cache_lookup("catalog", hit=False)
+        return None
+
+    stamp = (stat.st_ino, stat.st_mtime_ns)
+    reloaded = _catalog_stamp != stamp
+    if reloaded:
+        try:
+            _catalog = Catalog(CATALOG_FILE)
+        except ValueError:
+            _catalog = None  # built by another version
+        _catalog_stamp = stamp
+
+    if _catalog is None or _catalog.sources_stamp != get_sources_stamp():
+        record_cache_lookup("catalog", hit=False)
+        return None
+    record_cache_lookup("catalog", hit=not reloaded)
+    return _catalog
+
+
+if __name__ == "__main__":
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else CATALOG_FILE
+    build_catalog(path)
+    print(f"Catalog saved to {path} ({path.stat().st_size} bytes)")
@@ -1,41 +1,97 @@
+import atexit
 import json
 import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Callable, Iterable, TypeVar
 from urllib.parse import quote
 
+from models import DEVICE_REGISTRY, MODEL_REGISTRY
+
+T = TypeVar("T")
+
 HERE = Path(__file__).parent
-JOB_ID_MAPPING_FILE = HERE / "job_id_mapping.json"
-FIGMA_DIR = HERE / "static"
-OCR_RESULTS_FILE = HERE / "ocr_results.json"
+# Allows for running the app and scripts on a different data set (e.g. benchmarks)
+DATA_DIR = Path(os.environ.get("FIGMA_UI_DATA_DIR", HERE))
+JOB_ID_MAPPING_FILE = DATA_DIR / "job_id_mapping.json"
+FIGMA_DIR = DATA_DIR / "static"
+OCR_RESULTS_FILE = DATA_DIR / "ocr_results.json"
+VISUAL_RESULTS_FILE = DATA_DIR / "visual_results.json"
+# Screens exported from Figma, in the same structure as the screenshots
+FIGMA_EXPORT_DIR = DATA_DIR / "figma_export"
+LOG_FILE = Path(os.environ.get("FIGMA_UI_LOG_FILE", DATA_DIR / "app.log"))
+# Local copy of the test reports, see `mirror.py`
+MIRROR_FILE = DATA_DIR / "mirror.zip"
+
+REPORTS_URL = os.environ.get("FIGMA_UI_REPORTS_URL", "https://satoshilabs.gitlab.io")
 
 MODEL_DIR_MAPPING = {
-    "tt": FIGMA_DIR / "tt",
-    "tr": FIGMA_DIR / "tr",
+    name: FIGMA_DIR / model.screens_dir for name, model in MODEL_REGISTRY.items()
 }
 
 for dir in MODEL_DIR_MAPPING.values():
-    dir.mkdir(exist_ok=True)
+    dir.mkdir(parents=True, exist_ok=True)
+
+MODEL_SCREEN_SIZES = {
+    name: DEVICE_REGISTRY[model.device].screen_size
+    for name, model in MODEL_REGISTRY.items()
+}
 
 MODEL_FILE_MAPPING = {
-    "tt": HERE / "figma_screens_tt.json",
-    "tr": HERE / "figma_screens_tr.json",
+    name: DATA_DIR / model.screens_file for name, model in MODEL_REGISTRY.items()
 }
 
 TEST_CASE_MAPPING = {
-    "TR-click_tests": "core click R test",
-    "TR-device_tests": "core device R test",
-    "TT-click_tests": "core click test",
-    "TT-device_tests": "core device test",
+    test_alias: job
+    for model in MODEL_REGISTRY.values()
+    for test_alias, job in model.jobs.items()
 }
 
+# Threads for the per-model work, mostly waiting for files, network or subprocesses
+MODEL_WORKERS = 8
+# Created up front (the threads are started lazily), so concurrent requests share it
+_model_executor = ThreadPoolExecutor(
+    max_workers=MODEL_WORKERS, thread_name_prefix="model"
+)
+_model_worker = threading.local()
+
+
+def _run_in_model_worker(func: Callable[[str], T], model: str) -> T:
+    _model_worker.active = True
+    try:
+        return func(model)
+    finally:
+        _model_worker.active = False
+
+
+def map_models(func: Callable[[str], T], models: Iterable[str]) -> list[T]:
+    """Run `func` for all the models concurrently, results are in the same order."""
+    models = list(models)
+    # Nested calls are run inline, waiting for the same pool could deadlock
+    if len(models) < 2 or getattr(_model_worker, "active", False):
+        return [func(model) for model in models]
+    return list(_model_executor.map(partial(_run_in_model_worker, func), models))
 
-def get_ocr_results() -> dict[str, dict[str, int]]:
+
+def get_ocr_results() -> dict[str, dict[str, dict[str, int]]]:
     if not OCR_RESULTS_FILE.exists():
         return {}
     with open(OCR_RESULTS_FILE) as f:
         return json.load(f)
 
 
+def get_visual_results() -> dict[str, dict[str, dict[str, int]]]:
+    if not VISUAL_RESULTS_FILE.exists():
+        return {}
+    with open(VISUAL_RESULTS_FILE) as f:
+        return json.load(f)
+
+
 def get_screen_text_content(file: Path) -> dict[str, list[dict[str, str]]]:
     with open(file) as f:
         return json.load(f)
@@ -55,9 +111,13 @@ def get_latest_test_report_url(test_name: str) -> str:
     test_job = get_job_from_test_case(test_name)
     job_id_mapping = get_current_job_id_mapping()
     job_id = job_id_mapping[test_job]
+    return get_test_report_url(test_name, job_id)
+
+
+def get_test_report_url(test_name: str, job_id: str) -> str:
     test_in_url = f"{test_name}.html"
     quoted_test_url = quote(test_in_url)
-    passed_tests_url = f"https://satoshilabs.gitlab.io/-/trezor/trezor-firmware/-/jobs/{job_id}/artifacts/test_ui_report/passed"
+    passed_tests_url = f"{REPORTS_URL}/-/trezor/trezor-firmware/-/jobs/{job_id}/artifacts/test_ui_report/passed"
     return f"{passed_tests_url}/{quoted_test_url}"
 
 
@@ -67,10 +127,19 @@ def get_job_from_test_case(test_case: str) -> str:
 
 
 def get_logger(name: str, log_file_path: str | Path) -> logging.Logger:
+    """Get a logger writing into a file from a background thread.
+
+    Records are only put into a queue by the caller, so slow disk
+    does not add to the request latency.
+    """
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
     log_handler = logging.FileHandler(log_file_path)
     log_formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
     log_handler.setFormatter(log_formatter)
-    logger.addHandler(log_handler)
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, log_handler)
+    listener.start()
+    atexit.register(listener.stop)
     return logger
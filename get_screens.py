@@ -10,34 +10,42 @@ import click
 import requests
 
 from common import (
+    MIRROR_FILE,
     MODEL_DIR_MAPPING,
     MODEL_FILE_MAPPING,
-    get_latest_test_report_url,
-    get_screen_text_content,
+    map_models,
     save_job_id_mapping,
 )
-from gitlab import get_branch_job_ids
+from gitlab import DEFAULT_BRANCH, get_branch_job_ids
+from mirror import Mirror, get_mirror
+from screens import get_flows, load_screens
 
 OVERWRITE = False
 DEBUG = False
-DEFAULT_BRANCH = "main"
+# When set, reports and images are read from the mirror instead of the network
+MIRROR: Mirror | None = None
 
 
 @lru_cache(maxsize=None)
 def get_html_content(url: str) -> str:
+    if MIRROR is not None:
+        return MIRROR.read_url(url).decode()
     response = requests.get(url)
     response.raise_for_status()
     return response.text
 
 
 def get_image_content(url: str) -> bytes:
+    if MIRROR is not None:
+        return MIRROR.read_url(url)
     response = requests.get(url)
     response.raise_for_status()
     return response.content
 
 
-def get_img_url_from_last_test(test_case: str, id: str) -> str:
-    url = get_latest_test_report_url(test_case)
+def get_img_url_from_last_test(url: str, id: int) -> str:
+    if not url:
+        raise ValueError("No test report, job is not in the job mapping")
     if DEBUG:
         print(f"Test URL: {url}")
 
@@ -68,61 +76,91 @@ def download_img(dir: Path, flow_name: str, screen_name: str, img_url: str) -> N
     img_path.write_bytes(img_bytes)
 
 
+def download_model(model: str, flows_to_update: list[str]) -> list[str]:
+    """Download the screens of one model, returning the failures."""
+    dir = MODEL_DIR_MAPPING[model]
+    all_flows = get_flows(load_screens(model))
+
+    failed_to_download: list[str] = []
+    for flow_name, flow_screens in all_flows.items():
+        if flows_to_update and flow_name not in flows_to_update:
+            continue
+        click.echo(f"[{model}] Getting screens for flow {flow_name}")
+        for screen in flow_screens:
+            if screen.missing:
+                click.echo(f"[{model}] Skipping missing screen {screen.screen_id}")
+                continue
+            screen_name = screen.name
+            click.echo(f"[{model}] Getting image {screen.test}#{screen.screen_id}")
+            try:
+                img_url = get_img_url_from_last_test(screen.test_url, screen.screen_id)
+                if DEBUG:
+                    click.echo(f"Image URL: {img_url}")
+                download_img(dir, flow_name, screen_name, img_url)
+            except Exception as e:
+                click.echo(f"[{model}] Failed to download - {e}")
+                failed_to_download.append(f"{model} {flow_name}#{screen_name}: {e}")
+    return failed_to_download
+
+
 @click.command()
 # fmt: off
 @click.option("-d", "--debug", is_flag=True, help="Show debug logs")
 @click.option("-u", "--update", is_flag=True, help="Do not download already existing images")
 @click.option("-b", "--branch", default=DEFAULT_BRANCH, help="Which branch to use")
 @click.option("-f", "--flows-to-update", multiple=True, help="Which flows to update")
-@click.argument("model", type=click.Choice(list(MODEL_FILE_MAPPING.keys()), case_sensitive=False))
+@click.option("-m", "--mirror", is_flag=True, help="Use the mirrored reports, without network")
+@click.argument("models", nargs=-1, type=click.Choice(list(MODEL_FILE_MAPPING.keys()), case_sensitive=False))
 # fmt: on
-def cli(debug: bool, update: bool, branch: str, model: str, flows_to_update: list[str]):
-    global OVERWRITE, DEBUG
+def cli(
+    debug: bool,
+    update: bool,
+    branch: str,
+    models: tuple[str, ...],
+    flows_to_update: list[str],
+    mirror: bool,
+):
+    """Download the screens of MODELS (all of them by default)."""
+    global OVERWRITE, DEBUG, MIRROR
 
     OVERWRITE = not update  # type: ignore
     DEBUG = debug  # type: ignore
 
-    click.echo(f"Using branch {branch} and model {model}")
+    models = models or tuple(MODEL_FILE_MAPPING.keys())
+    if mirror:
+        MIRROR = get_mirror()
+        if MIRROR is None:
+            raise click.ClickException(f"No mirror in {MIRROR_FILE}, run mirror.py")
+        branch = MIRROR.get_info().get("branch", "unknown")
+        click.echo(
+            f"Using the mirror of branch {branch} and models {', '.join(models)}"
+        )
+    else:
+        click.echo(f"Using branch {branch} and models {', '.join(models)}")
 
     if flows_to_update:
         click.echo(f"Updating only flows {flows_to_update}")
 
-    file = MODEL_FILE_MAPPING.get(model)
-    if not file:
-        raise ValueError(f"Model {model} not found")
-    dir = MODEL_DIR_MAPPING.get(model)
-    if not dir:
-        raise ValueError(f"Model {model} not found")
-
-    all_flows = get_screen_text_content(file)
+    # Validating the definitions before any network request
+    all_flows: set[str] = set()
+    for model in models:
+        all_flows.update(get_flows(load_screens(model)))
     for flow_to_update in flows_to_update:
         if flow_to_update not in all_flows:
             raise ValueError(f"Flow {flow_to_update} not found")
 
-    jobs_id_mapping = get_branch_job_ids(branch)
+    # All models share the jobs of the same pipeline
+    if MIRROR is not None:
+        jobs_id_mapping = MIRROR.get_job_id_mapping()
+    else:
+        jobs_id_mapping = get_branch_job_ids(branch)
     save_job_id_mapping(jobs_id_mapping)
 
     failed_to_download: list[str] = []
-    for flow_name, flow_screens in all_flows.items():
-        if flows_to_update and flow_name not in flows_to_update:
-            continue
-        click.echo(f"Getting screens for flow {flow_name}")
-        for index, screen_info in enumerate(flow_screens, start=1):
-            if "missing" in screen_info:
-                click.echo(f"Skipping missing screen {screen_info['screen_id']}")
-                continue
-            screen_name = f"{flow_name}{index}"
-            test_case = screen_info["test"]
-            screen_id = screen_info["screen_id"]
-            click.echo(f"Getting image {test_case}#{screen_id}")
-            try:
-                img_url = get_img_url_from_last_test(test_case, screen_id)
-                if DEBUG:
-                    click.echo(f"Image URL: {img_url}")
-                download_img(dir, flow_name, screen_name, img_url)
-            except Exception as e:
-                click.echo(f"Failed to download - {e}")
-                failed_to_download.append(f"{flow_name}#{screen_name}: {e}")
+    for model_failures in map_models(
+        lambda model: download_model(model, flows_to_update), models
+    ):
+        failed_to_download.extend(model_failures)
 
     if failed_to_download:
         click.echo("Failed to download:")
@@ -6,6 +6,7 @@ Allowing for interaction with the test results, e.g. with UI tests.
 
 from __future__ import annotations
 
+import os
 from pathlib import Path
 from typing import Any, Iterator
 
@@ -15,8 +16,14 @@ AnyDict = dict[Any, Any]
 
 HERE = Path(__file__).parent
 
-BRANCHES_API_TEMPLATE = "https://gitlab.com/satoshilabs/trezor/trezor-firmware/-/pipelines.json?scope=branches&page={}"
-GRAPHQL_API = "https://gitlab.com/api/graphql"
+GITLAB_URL = os.environ.get("FIGMA_UI_GITLAB_URL", "https://gitlab.com")
+BRANCHES_API_TEMPLATE = (
+    GITLAB_URL
+    + "/satoshilabs/trezor/trezor-firmware/-/pipelines.json?scope=branches&page={}"
+)
+GRAPHQL_API = f"{GITLAB_URL}/api/graphql"
+
+DEFAULT_BRANCH = "main"
 
 
 def _get_gitlab_branches(page: int) -> list[AnyDict]:
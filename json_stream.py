@@ -0,0 +1,190 @@
+"""
+Incremental parsing of the translation JSON files.
+
+The translations are yielded one by one as soon as they arrive, so big
+payloads do not need to be held in memory as a whole. Both the full file
+(with `translations` object next to e.g. `header`) and a flat object
+of translations are supported. Top-level strings are yielded until the
+`header` or `translations` member shows it is the full file.
+"""
+
+from __future__ import annotations
+
+import json
+from json.decoder import scanstring
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+
+# Biggest single key or value we are willing to buffer
+MAX_BUFFERED_CHARS = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+
+# Top-level members only present in the full file
+FULL_FORMAT_KEYS = ("header", "translations")
+
+# Values which could still be completed by more data, when cut at the end
+_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+
+
+class NeedMoreData(Exception):
+    pass
+
+
+class TranslationParser:
+    """Push parser yielding the (key, value) string pairs of the translations.
+
+    Feed it chunks of text via `feed`, which returns the translations
+    completed by that chunk. `close` verifies the whole document was read.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._pos = 0
+        # Characters of the document dropped from the start of the buffer
+        self._offset = 0
+        # Stack of the objects we are in - "top" or "translations"
+        self._stack: list[str] = []
+        self._started = False
+        self._full_format = False
+        self._finished = False
+        self._expect_comma = False
+
+    def feed(self, text: str) -> list[tuple[str, str]]:
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        items: list[tuple[str, str]] = []
+        try:
+            while not self._finished:
+                item = self._step()
+                if item is not None:
+                    items.append(item)
+        except NeedMoreData:
+            if len(self._buffer) - self._pos > MAX_BUFFERED_CHARS:
+                raise ValueError("Too long JSON value")
+        return items
+
+    def close(self) -> None:
+        if not self._finished:
+            raise ValueError("Incomplete JSON document")
+        if self._buffer[self._pos :].strip(WHITESPACE):
+            raise ValueError("Extra data after the JSON document")
+
+    def _skip_whitespace(self) -> str:
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+            self._pos += 1
+        if self._pos >= len(self._buffer):
+            raise NeedMoreData
+        return self._buffer[self._pos]
+
+    def _error(self, message: str, pos: int | None = None) -> ValueError:
+        pos = self._pos if pos is None else pos
+        return ValueError(f"{message} at position {self._offset + pos}")
+
+    def _expect(self, char: str) -> None:
+        if self._skip_whitespace() != char:
+            raise self._error(f"Expected '{char}'")
+        self._pos += 1
+
+    def _is_truncated(self, error: json.JSONDecodeError) -> bool:
+        """Whether the value is only cut at the end of the buffer, not malformed."""
+        if error.pos >= len(self._buffer):
+            return True
+        if error.msg.startswith("Unterminated string"):
+            return True
+        rest = self._buffer[error.pos :]
+        # \uXXXX escape (or a surrogate pair) not complete yet
+        if error.msg.startswith("Invalid \\uXXXX") and '"' not in rest:
+            return True
+        # Number inside of a skipped value, e.g. `[1, 2.5e`
+        if not rest.strip(NUMBER_CHARS):
+            return True
+        return error.msg == "Expecting value" and any(
+            literal.startswith(rest) for literal in _LITERALS
+        )
+
+    def _decode_error(self, error: json.JSONDecodeError) -> Exception:
+        if self._is_truncated(error):
+            return NeedMoreData()
+        return self._error(error.msg, error.pos)
+
+    def _read_string(self) -> tuple[str, int]:
+        """Read a string starting at current position, without consuming it."""
+        try:
+            return scanstring(self._buffer, self._pos + 1)
+        except json.JSONDecodeError as e:
+            raise self._decode_error(e)
+
+    def _step(self) -> tuple[str, str] | None:
+        """Process one member of the current object.
+
+        Position is only moved forward when the whole member was read,
+        so that it can be retried with more data.
+        """
+        if not self._started:
+            self._expect("{")
+            self._started = True
+            self._stack.append("top")
+            return None
+
+        char = self._skip_whitespace()
+        if char == "}":
+            self._pos += 1
+            self._stack.pop()
+            self._expect_comma = True
+            if not self._stack:
+                self._finished = True
+            return None
+        if self._expect_comma and char != ",":
+            raise self._error("Expected ','")
+
+        start = self._pos
+        try:
+            if self._expect_comma:
+                self._pos += 1
+                self._skip_whitespace()
+            return self._read_member()
+        except NeedMoreData:
+            self._pos = start
+            raise
+
+    def _read_member(self) -> tuple[str, str] | None:
+        if self._buffer[self._pos] != '"':
+            raise self._error("Expected a key")
+        key, end = self._read_string()
+        self._pos = end
+        self._expect(":")
+        char = self._skip_whitespace()
+
+        if key == "tutorial":
+            raise ValueError("OLD FORMAT - please use new one")
+        in_top = self._stack[-1] == "top"
+        if in_top and key in FULL_FORMAT_KEYS:
+            self._full_format = True
+        if char == '"':
+            value, end = self._read_string()
+            self._pos = end
+            self._expect_comma = True
+            # Only the `translations` of the full file are translations
+            if in_top and self._full_format:
+                return None
+            return key, value
+        if in_top and key == "translations" and char == "{":
+            self._pos += 1
+            self._stack.append("translations")
+            self._expect_comma = False
+            return None
+
+        # Other values (e.g. header) are skipped, they must be complete to do so
+        try:
+            _, end = _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError as e:
+            raise self._decode_error(e)
+        # Numbers and literals could continue in the next chunk (e.g. `1.` or `1e`)
+        if not self._buffer[end:].strip(NUMBER_CHARS):
+            raise NeedMoreData
+        self._pos = end
+        self._expect_comma = True
+        return None
@@ -0,0 +1,186 @@
+"""
+Minimal in-process metrics, exposed in the Prometheus text format.
+
+Each worker process keeps its own values, the `pid` of the worker is part
+of the exposition so the scraped series from different workers do not clash.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, **extra: str) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    pairs.append(("pid", str(os.getpid())))
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _label_values(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def expose(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self) -> list[str]:
+        lines = super().expose()
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class CacheCounter(Counter):
+    """Counter of cache lookups, which can also report `functools.lru_cache` stats."""
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help, labels=("cache", "result"))
+        self._lru_caches: dict[str, Any] = {}
+
+    def watch_lru_cache(self, cache: str, func: Any) -> None:
+        self._lru_caches[cache] = func
+
+    def expose(self) -> list[str]:
+        lines = super().expose()
+        for cache, func in self._lru_caches.items():
+            info = func.cache_info()
+            for result, value in (("hit", info.hits), ("miss", info.misses)):
+                labels = _format_labels(self.labels, (cache, result))
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # Per label values: non-cumulative bucket counts (last one is +Inf) and sum
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bucket] += 1
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self) -> list[str]:
+        lines = super().expose()
+        with self._lock:
+            values = [(k, list(v), self._sums[k]) for k, v in self._counts.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            bounds = [str(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, le=bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+REQUEST_DURATION = Histogram(
+    "figma_ui_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    labels=("method", "route", "status"),
+)
+DATA_PREP_DURATION = Histogram(
+    "figma_ui_data_prep_duration_seconds",
+    "Time spent preparing the screen data for a page.",
+    labels=("function",),
+)
+TEMPLATE_RENDER_DURATION = Histogram(
+    "figma_ui_template_render_duration_seconds",
+    "Time spent rendering HTML templates.",
+    labels=("template",),
+)
+CACHE_REQUESTS = CacheCounter(
+    "figma_ui_cache_requests_total",
+    "Cache lookups, by cache and result (hit / miss).",
+)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
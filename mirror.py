@@ -0,0 +1,222 @@
+"""
+Offline mirror of the UI test reports.
+
+All the test reports referenced by the screen definitions, together with
+their images, are downloaded once for a pipeline into one compressed
+archive (`mirror.zip`). Files are stored under their URL path on the
+reports server, so the relative links inside the reports keep working.
+
+When the archive exists, the app serves the mirrored reports under
+`/mirror/` and links to them instead of Gitlab pages, and
+`get_screens.py --mirror` rebuilds `static/` from it with no network.
+The archive is deterministic - the same reports give the same bytes.
+
+Usage:
+    python mirror.py [-b BRANCH] [MODELS]...
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote, unquote, urljoin, urlsplit
+
+import click
+import requests
+
+from common import MIRROR_FILE, MODEL_FILE_MAPPING, REPORTS_URL
+from gitlab import DEFAULT_BRANCH, get_branch_job_ids
+from screens import compile_model
+
+MIRROR_ROUTE = "/mirror"
+JOB_ID_MAPPING_NAME = "job_id_mapping.json"
+INFO_NAME = "mirror.json"
+
+# Fixed timestamp of all the entries, so the archive only depends on the content
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# Already compressed files are only stored
+STORED_SUFFIXES = (".png", ".jpg", ".gif", ".webp")
+
+DOWNLOAD_WORKERS = 16
+
+IMG_SRC_RE = re.compile(r'<img\b[^>]*?\bsrc="(.*?)"')
+
+
+def get_archive_name(url: str) -> str | None:
+    """Name of the URL inside the archive, None when it is not on the reports server."""
+    if not url.startswith(REPORTS_URL + "/"):
+        return None
+    return unquote(urlsplit(url[len(REPORTS_URL) :]).path).lstrip("/")
+
+
+class Mirror:
+    """Read access to the mirror archive, safe to share between threads."""
+
+    def __init__(self, path: Path):
+        self._archive = zipfile.ZipFile(path)
+        self.names = frozenset(self._archive.namelist())
+
+    def read(self, name: str) -> bytes | None:
+        if name not in self.names:
+            return None
+        return self._archive.read(name)
+
+    def read_url(self, url: str) -> bytes:
+        name = get_archive_name(url)
+        content = self.read(name) if name is not None else None
+        if content is None:
+            raise ValueError(f"{url} is not in the mirror")
+        return content
+
+    def get_link(self, url: str) -> str:
+        """Link to the mirrored copy of the URL, or the URL itself when not mirrored."""
+        name = get_archive_name(url)
+        if name is None or name not in self.names:
+            return url
+        return f"{MIRROR_ROUTE}/{quote(name)}"
+
+    def get_job_id_mapping(self) -> dict[str, str]:
+        content = self.read(JOB_ID_MAPPING_NAME)
+        if content is None:
+            raise ValueError("Job mapping is not in the mirror")
+        return json.loads(content)
+
+    def get_info(self) -> dict[str, str]:
+        content = self.read(INFO_NAME)
+        return json.loads(content) if content is not None else {}
+
+
+_mirror: Mirror | None = None
+_mirror_stamp: tuple[int, int] | None = None
+
+
+def get_mirror() -> Mirror | None:
+    """Get the mirror, if the archive exists. Reopened when it is replaced."""
+    global _mirror, _mirror_stamp
+
+    try:
+        stat = MIRROR_FILE.stat()
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_ino, stat.st_mtime_ns)
+    if _mirror is None or _mirror_stamp != stamp:
+        _mirror = Mirror(MIRROR_FILE)
+        _mirror_stamp = stamp
+    return _mirror
+
+
+def get_report_urls(models: list[str], job_id_mapping: dict[str, str]) -> list[str]:
+    """All the test report URLs needed by the screens of the models."""
+    urls: set[str] = set()
+    for model in models:
+        for screen in compile_model(model, job_id_mapping):
+            if screen.missing:
+                continue
+            if not screen.test_url:
+                click.echo(f"No job {screen.job} for {screen.test}")
+                continue
+            urls.add(screen.test_url)
+    return sorted(urls)
+
+
+def download(url: str) -> bytes:
+    response = requests.get(url)
+    response.raise_for_status()
+    return response.content
+
+
+def get_image_urls(report_url: str, html: str) -> set[str]:
+    return {
+        urljoin(report_url, src)
+        for src in IMG_SRC_RE.findall(html)
+        if not src.startswith("data:")
+    }
+
+
+def download_all(
+    urls: list[str], executor: ThreadPoolExecutor, failed: list[str]
+) -> dict[str, bytes]:
+    """Download the URLs in parallel, returning their content by archive name."""
+
+    def _download(url: str) -> bytes | None:
+        try:
+            return download(url)
+        except requests.RequestException as e:
+            failed.append(f"{url}: {e}")
+            return None
+
+    files: dict[str, bytes] = {}
+    for url, content in zip(urls, executor.map(_download, urls)):
+        name = get_archive_name(url)
+        if content is not None and name is not None:
+            files[name] = content
+    return files
+
+
+def write_archive(path: Path, files: dict[str, bytes]) -> None:
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with zipfile.ZipFile(tmp_path, "w") as archive:
+        for name in sorted(files):
+            info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+            if name.endswith(STORED_SUFFIXES):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, files[name], compresslevel=9)
+    os.replace(tmp_path, path)
+
+
+def build_mirror(branch: str, models: list[str], path: Path) -> list[str]:
+    """Download the reports of the latest pipeline of the branch, returning the failures."""
+    job_id_mapping = get_branch_job_ids(branch)
+    report_urls = get_report_urls(models, job_id_mapping)
+    click.echo(f"Downloading {len(report_urls)} test reports")
+
+    failed: list[str] = []
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        reports = download_all(report_urls, executor, failed)
+        image_urls: set[str] = set()
+        for url in report_urls:
+            name = get_archive_name(url)
+            if name in reports:
+                image_urls.update(
+                    get_image_urls(url, reports[name].decode(errors="replace"))
+                )
+        # Images outside of the reports server cannot be served from the mirror
+        image_urls = {url for url in image_urls if get_archive_name(url) is not None}
+        click.echo(f"Downloading {len(image_urls)} images")
+        images = download_all(sorted(image_urls), executor, failed)
+
+    files = {**reports, **images}
+    files[JOB_ID_MAPPING_NAME] = json.dumps(job_id_mapping, indent=2).encode()
+    files[INFO_NAME] = json.dumps(
+        {"branch": branch, "reports_url": REPORTS_URL}
+    ).encode()
+    write_archive(path, files)
+    return failed
+
+
+@click.command()
+# fmt: off
+@click.option("-b", "--branch", default=DEFAULT_BRANCH, help="Which branch to use")
+@click.option("-o", "--output", type=click.Path(path_type=Path), default=MIRROR_FILE, help="Where to save the archive")
+@click.argument("models", nargs=-1, type=click.Choice(list(MODEL_FILE_MAPPING.keys())))
+# fmt: on
+def cli(branch: str, output: Path, models: tuple[str, ...]):
+    """Mirror the test reports of MODELS (all of them by default)."""
+    failed = build_mirror(branch, list(models) or list(MODEL_FILE_MAPPING), output)
+    click.echo(f"Mirror saved to {output} ({output.stat().st_size} bytes)")
+    if failed:
+        click.echo("Failed to download:")
+        for error in failed:
+            click.echo(error)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
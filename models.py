@@ -0,0 +1,116 @@
+"""
+Registry of the supported devices and models, loaded from `models.json`.
+
+Devices describe the hardware - screen geometry and fonts used for the
+translation checks and previews. Models are the sets of Figma screens
+downloaded from the UI tests, each of them shown on one of the devices.
+
+Adding a model means adding its entry (and its `figma_screens_<model>.json`),
+no code changes are needed.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+HERE = Path(__file__).parent
+MODELS_FILE = Path(os.environ.get("FIGMA_UI_MODELS_FILE", HERE / "models.json"))
+
+
+class ModelConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class DeviceConfig:
+    name: str
+    width: int
+    height: int
+    text_width: int  # available for the text, without the margins
+    margin: int  # left margin of the text
+    line_height: int
+    glyph_height: int
+    max_button_width: int
+    fonts: dict[str, str]  # text type -> font in the width table
+    font_table: str  # width table of the fonts in `font_widths.json`
+    skip_translations: tuple[str, ...]  # key prefixes not shown on the device
+
+    @property
+    def screen_size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    name: str
+    device: str
+    screens_file: str  # relative to the data directory
+    screens_dir: str  # relative to the static directory
+    jobs: dict[str, str]  # test prefix (e.g. TT-click_tests) -> CI job name
+    ocr_preprocessing: str
+
+
+def _get(config: dict[str, Any], key: str, where: str, default: Any = None) -> Any:
+    if key in config:
+        return config[key]
+    if default is None:
+        raise ModelConfigError(f"{where}: missing '{key}'")
+    return default
+
+
+def parse_device(name: str, config: dict[str, Any]) -> DeviceConfig:
+    where = f"device {name}"
+    return DeviceConfig(
+        name=name,
+        width=_get(config, "width", where),
+        height=_get(config, "height", where),
+        text_width=_get(config, "text_width", where),
+        margin=_get(config, "margin", where),
+        line_height=_get(config, "line_height", where),
+        glyph_height=_get(config, "glyph_height", where),
+        max_button_width=_get(config, "max_button_width", where),
+        fonts=_get(config, "fonts", where),
+        font_table=_get(config, "font_table", where, name),
+        skip_translations=tuple(_get(config, "skip_translations", where, [])),
+    )
+
+
+def parse_model(name: str, config: dict[str, Any]) -> ModelConfig:
+    where = f"model {name}"
+    return ModelConfig(
+        name=name,
+        device=_get(config, "device", where),
+        screens_file=_get(config, "screens_file", where, f"figma_screens_{name}.json"),
+        screens_dir=_get(config, "screens_dir", where, name),
+        jobs=_get(config, "jobs", where),
+        ocr_preprocessing=_get(config, "ocr_preprocessing", where, "bicubic"),
+    )
+
+
+def load_registry(
+    file: Path,
+) -> tuple[dict[str, DeviceConfig], dict[str, ModelConfig]]:
+    try:
+        content = json.loads(file.read_text())
+    except (OSError, json.JSONDecodeError) as e:
+        raise ModelConfigError(f"Cannot load {file}: {e}")
+
+    devices = {
+        name: parse_device(name, config)
+        for name, config in content.get("devices", {}).items()
+    }
+    models = {
+        name: parse_model(name, config)
+        for name, config in content.get("models", {}).items()
+    }
+    for model in models.values():
+        if model.device not in devices:
+            raise ModelConfigError(f"model {model.name}: unknown device {model.device}")
+    return devices, models
+
+
+DEVICE_REGISTRY, MODEL_REGISTRY = load_registry(MODELS_FILE)
@@ -1,10 +1,48 @@
+"""
+Downscaling of the screens exported from Figma to the device resolution.
+
+Single file:
+    python resizer.py tr "Tutorial 08.png" figma_export/tr/Tutorial/Tutorial8.png
+
+Whole directory (keeping its structure, e.g. `<flow>/<screen>.png`):
+    python resizer.py tr ~/Downloads/figma_tr figma_export/tr
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import click
 from PIL import Image
 
-image_path = "/home/jmusil/Downloads/Firmware(6)/Tutorial 08.png"
-img = Image.open(image_path)
+from common import MODEL_SCREEN_SIZES
+
+
+def resize_to_screen(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    # Use the NEAREST algorithm to keep the pixelated style
+    if img.size == size:
+        return img
+    return img.resize(size, Image.NEAREST)
+
+
+def resize_file(src: Path, dst: Path, size: tuple[int, int]) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(src) as img:
+        resize_to_screen(img, size).save(dst)
+
+
+@click.command()
+@click.argument("model", type=click.Choice(list(MODEL_SCREEN_SIZES.keys())))
+@click.argument("src", type=click.Path(exists=True, path_type=Path))
+@click.argument("dst", type=click.Path(path_type=Path))
+def cli(model: str, src: Path, dst: Path):
+    size = MODEL_SCREEN_SIZES[model]
+    if src.is_file():
+        resize_file(src, dst, size)
+        return
+    for src_file in sorted(src.rglob("*.png")):
+        resize_file(src_file, dst / src_file.relative_to(src), size)
 
-# Use the NEAREST algorithm to keep the pixelated style
-original_size = (128, 64)
-img_resized = img.resize(original_size, Image.NEAREST)
 
-img_resized.save("path_to_save_resized_image.png")
+if __name__ == "__main__":
+    cli()
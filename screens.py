@@ -0,0 +1,319 @@
+"""
+Validation and compilation of the screen definitions.
+
+The hand-edited `figma_screens_<model>.json` files are validated against
+the schema below and compiled into `Screen` records, with everything
+derived from them precomputed. The compiled records of each model are
+saved into its own pickle file, which is used until any of its sources
+changes - invalid definitions of one model do not affect the others.
+
+Run `python screens.py` (or `make screens`) before deploying, it fails
+with all the problems found in the definitions.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import re
+import sys
+import threading
+from pathlib import Path
+from typing import Any
+
+from common import (
+    DATA_DIR,
+    JOB_ID_MAPPING_FILE,
+    MODEL_FILE_MAPPING,
+    TEST_CASE_MAPPING,
+    get_current_job_id_mapping,
+    get_job_from_test_case,
+    get_screen_text_content,
+    get_test_report_url,
+)
+from models import MODELS_FILE
+
+COMPILED_VERSION = 1
+
+# key: (allowed types, required)
+SCREEN_SCHEMA: dict[str, tuple[tuple[type, ...], bool]] = {
+    "description": ((str,), True),
+    "test": ((str,), True),
+    "screen_id": ((int,), True),
+    "compare_index": ((int,), False),
+    "comment": ((str,), False),
+    "ok_to_fail_ocr": ((bool,), False),
+    "missing": ((str, bool), False),
+}
+
+
+class ScreenDefinitionError(ValueError):
+    pass
+
+
+class Screen:
+    """One screen of a flow, with all the derived data precomputed."""
+
+    __slots__ = (
+        "model",
+        "flow_name",
+        "index",
+        "name",
+        "test",
+        "job",
+        "screen_id",
+        "description",
+        "comment",
+        "compare_index",
+        "ok_to_fail_ocr",
+        "missing",
+        "img_src",
+        "img_path",
+        "test_url",
+        "title",
+        "body",
+        "buttons",
+        "has_title",
+        "has_buttons",
+    )
+
+    def __init__(
+        self,
+        model: str,
+        flow_name: str,
+        index: int,
+        screen_info: dict[str, Any],
+        job_id_mapping: dict[str, str] | None,
+    ):
+        self.model = model
+        self.flow_name = sys.intern(flow_name)
+        self.index = index
+        self.name = f"{flow_name}{index}"
+        self.test: str = sys.intern(screen_info["test"])
+        self.job = get_job_from_test_case(self.test)
+        self.screen_id: int = screen_info["screen_id"]
+        self.description: str = screen_info["description"]
+        self.comment: str = screen_info.get("comment", "")
+        self.compare_index: int | None = screen_info.get("compare_index")
+        self.ok_to_fail_ocr: bool = screen_info.get("ok_to_fail_ocr", False)
+        self.missing: bool = "missing" in screen_info
+        self.img_src = f"/static/{model}/{flow_name}/{self.name}.png"
+        self.img_path = Path(model) / flow_name / f"{self.name}.png"
+        # Without the job mapping (before the first update), there are no reports
+        self.test_url = ""
+        if job_id_mapping is not None and self.job in job_id_mapping:
+            self.test_url = get_test_report_url(self.test, job_id_mapping[self.job])
+        (
+            self.title,
+            self.body,
+            self.buttons,
+            self.has_title,
+            self.has_buttons,
+        ) = parse_description(self.description)
+
+    def __repr__(self) -> str:
+        return f"Screen({self.model}, {self.name}, {self.test}#{self.screen_id})"
+
+
+def parse_description(description: str) -> tuple[str, str, tuple[str, ...], bool, bool]:
+    """Split the description into (title, body, buttons, has_title, has_buttons).
+
+    E.g. `SKIP BACKUP || Are you sure? || <SKIP> <BACK UP>`.
+    Content of {xxx} and [xxx] (e.g. [homescreen]) is not part of the text.
+    """
+    description = re.sub(r"\{.*?\}", "", description)
+    description = re.sub(r"\[.*?\]", "", description)
+
+    parts = description.split("||")
+    try:
+        body = parts[-2].strip()
+    except IndexError:
+        body = description
+
+    potential_title = parts[0].strip()
+    has_title = bool(potential_title) and potential_title.upper() == potential_title
+    title = potential_title if has_title else ""
+    has_buttons = "<" in description and ">" in description
+    buttons = tuple(re.findall(r"<(.*?)>", description))
+
+    return title, body, buttons, has_title, has_buttons
+
+
+def validate_screen_info(screen_info: Any) -> list[str]:
+    """Get all the problems of one screen definition."""
+    if not isinstance(screen_info, dict):
+        return ["screen is not an object"]
+
+    errors: list[str] = []
+    for key, (types, required) in SCREEN_SCHEMA.items():
+        if key not in screen_info:
+            if required:
+                errors.append(f"missing '{key}'")
+            continue
+        value = screen_info[key]
+        # bool is a subclass of int, but is not a valid screen_id
+        if not isinstance(value, types) or (
+            bool not in types and isinstance(value, bool)
+        ):
+            type_names = " or ".join(t.__name__ for t in types)
+            errors.append(f"'{key}' should be {type_names}, not {value!r}")
+    for key in screen_info.keys() - SCREEN_SCHEMA.keys():
+        errors.append(f"unknown key '{key}'")
+
+    test = screen_info.get("test")
+    if isinstance(test, str):
+        test_alias = "-".join(test.split("-")[:2])
+        if test_alias not in TEST_CASE_MAPPING:
+            errors.append(f"unknown test job '{test_alias}'")
+    return errors
+
+
+def validate_screens_content(content: Any) -> list[str]:
+    """Get all the problems of the whole screen definitions file."""
+    if not isinstance(content, dict):
+        return ["content is not an object of flows"]
+
+    errors: list[str] = []
+    for flow_name, flow_data in content.items():
+        if not isinstance(flow_data, list):
+            errors.append(f"{flow_name}: flow is not a list of screens")
+            continue
+        for index, screen_info in enumerate(flow_data, start=1):
+            for error in validate_screen_info(screen_info):
+                errors.append(f"{flow_name}{index}: {error}")
+    return errors
+
+
+def compile_model(model: str, job_id_mapping: dict[str, str] | None) -> list[Screen]:
+    file = MODEL_FILE_MAPPING[model]
+    try:
+        content = get_screen_text_content(file)
+    except json.JSONDecodeError as e:
+        raise ScreenDefinitionError(f"{file.name}: invalid JSON - {e}")
+
+    errors = validate_screens_content(content)
+    if errors:
+        details = "\n".join(f"{file.name}: {error}" for error in errors)
+        raise ScreenDefinitionError(f"Invalid screen definitions:\n{details}")
+
+    return [
+        Screen(model, flow_name, index, screen_info, job_id_mapping)
+        for flow_name, flow_data in content.items()
+        for index, screen_info in enumerate(flow_data, start=1)
+    ]
+
+
+def compile_screens() -> dict[str, list[Screen]]:
+    """Validate and compile the screen definitions of all models."""
+    job_id_mapping = get_job_id_mapping()
+    compiled: dict[str, list[Screen]] = {}
+    errors: list[str] = []
+    for model in MODEL_FILE_MAPPING:
+        try:
+            compiled[model] = compile_model(model, job_id_mapping)
+        except ScreenDefinitionError as e:
+            errors.append(str(e))
+    if errors:
+        raise ScreenDefinitionError("\n".join(errors))
+    return compiled
+
+
+def get_job_id_mapping() -> dict[str, str] | None:
+    if not JOB_ID_MAPPING_FILE.exists():
+        return None
+    return get_current_job_id_mapping()
+
+
+def get_compiled_screens_file(model: str) -> Path:
+    return DATA_DIR / f"compiled_screens_{model}.pickle"
+
+
+def get_sources_stamp(model: str) -> tuple[int, ...]:
+    sources = [MODELS_FILE, MODEL_FILE_MAPPING[model], JOB_ID_MAPPING_FILE]
+    return tuple(
+        source.stat().st_mtime_ns if source.exists() else 0 for source in sources
+    )
+
+
+def save_compiled_screens(
+    model: str, screens: list[Screen], stamp: tuple[int, ...]
+) -> None:
+    path = get_compiled_screens_file(model)
+    # Several workers may be compiling at once
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump((COMPILED_VERSION, stamp, screens), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _load_compiled_screens(model: str, stamp: tuple[int, ...]) -> list[Screen] | None:
+    try:
+        with open(get_compiled_screens_file(model), "rb") as f:
+            version, saved_stamp, screens = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+        return None
+    if version != COMPILED_VERSION or saved_stamp != stamp:
+        return None
+    return screens
+
+
+# model -> (stamp of its sources, compiled screens)
+_compiled: dict[str, tuple[tuple[int, ...], list[Screen]]] = {}
+# The models are loaded from parallel threads
+_compile_lock = threading.Lock()
+
+
+def load_screens(model: str) -> list[Screen]:
+    """Compiled screens of the model, recompiled when its sources change.
+
+    Each model is compiled on its own, so invalid definitions of one model
+    only fail the pages of that model.
+    """
+    stamp = get_sources_stamp(model)
+    cached = _compiled.get(model)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with _compile_lock:
+        cached = _compiled.get(model)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        screens = _load_compiled_screens(model, stamp)
+        if screens is None:
+            # Inline - waiting here for the model threads could deadlock with
+            # the threads waiting for the lock
+            screens = compile_model(model, get_job_id_mapping())
+            try:
+                save_compiled_screens(model, screens, stamp)
+            except OSError:
+                pass  # read-only deployment, compiling on every start
+        _compiled[model] = (stamp, screens)
+    return screens
+
+
+def get_flows(screens: list[Screen]) -> dict[str, list[Screen]]:
+    """Group the screens by their flows, keeping the order."""
+    flows: dict[str, list[Screen]] = {}
+    for screen in screens:
+        flows.setdefault(screen.flow_name, []).append(screen)
+    return flows
+
+
+def main() -> None:
+    try:
+        compiled = compile_screens()
+    except ScreenDefinitionError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    for model, screens in compiled.items():
+        save_compiled_screens(model, screens, get_sources_stamp(model))
+        print(f"{model}: {len(screens)} screens OK")
+    print(f"Compiled screens saved to {DATA_DIR}")
+
+
+if __name__ == "__main__":
+    # Importing the module, so the pickled classes are not bound to __main__
+    from screens import main
+
+    main()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from json_stream import MAX_BUFFERED_CHARS, TranslationParser
+
+DOCUMENT = r"""{
+    "header": {
+        "language": "de-DE",
+        "version": 2.7e1,
+        "flags": [true, false, null, -12.5E-3],
+        "font": {"Tahoma": "fonts/tahoma.json", "sizes": [8, 10, 12]}
+    },
+    "release": "2.7.0",
+    "version": 123456,
+    "translations": {
+        "addr_mismatch__contact_support": "Kontakt \"Support\" \\ unter",
+        "unicode": "\u00fcber \ud83d\ude00 \u20ac \n\t",
+        "empty": "",
+        "skipped_number": 42,
+        "skipped_object": {"nested": ["a", {"b": "c"}]},
+        "words__continue": "Weiter"
+    },
+    "trailer": -0.5
+}"""
+
+EXPECTED = [
+    (key, value)
+    for key, value in json.loads(DOCUMENT)["translations"].items()
+    if isinstance(value, str)
+]
+
+
+def parse(chunks: list[str]) -> list[tuple[str, str]]:
+    parser = TranslationParser()
+    items: list[tuple[str, str]] = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    parser.close()
+    return items
+
+
+def split(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def parse_error(text: str) -> str:
+    parser = TranslationParser()
+    with pytest.raises(ValueError) as e:
+        parser.feed(text)
+        parser.close()
+    return str(e.value)
+
+
+def test_whole_document():
+    assert parse([DOCUMENT]) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 16, 64])
+def test_chunk_sizes(size: int):
+    assert parse(split(DOCUMENT, size)) == EXPECTED
+
+
+def test_every_split_point():
+    # Covers boundaries inside keys, escapes, \uXXXX, surrogates and numbers
+    for index in range(len(DOCUMENT) + 1):
+        assert parse([DOCUMENT[:index], DOCUMENT[index:]]) == EXPECTED, index
+
+
+def test_translations_are_yielded_early():
+    parser = TranslationParser()
+    items = parser.feed('{"translations": {"a": "b", "c": "d')
+    assert items == [("a", "b")]
+    assert parser.feed('"}}') == [("c", "d")]
+    parser.close()
+
+
+def test_flat_object():
+    assert parse(['{"a": "b",', ' "c": "d"}']) == [("a", "b"), ("c", "d")]
+
+
+@pytest.mark.parametrize("number", ["1.", "1e", "-", "12.5E-"])
+def test_number_cut_at_chunk_end(number: str):
+    chunks = ['{"version": ' + number, '5, "a": "b"}']
+    assert parse(chunks) == [("a", "b")]
+
+
+def test_literal_cut_at_chunk_end():
+    assert parse(['{"flag": tr', 'ue, "a": "b"}']) == [("a", "b")]
+
+
+def test_full_format_top_level_strings_are_not_translations():
+    document = '{"header": {}, "version": "1.0", "translations": {"a": "b"}}'
+    assert parse([document]) == [("a", "b")]
+
+
+def test_old_format():
+    assert "OLD FORMAT" in parse_error('{"tutorial": {"a": "b"}}')
+
+
+def test_old_format_string_value():
+    assert "OLD FORMAT" in parse_error('{"tutorial": "b"}')
+    assert "OLD FORMAT" in parse_error('{"translations": {"tutorial": "b"}}')
+
+
+def test_trailing_comma():
+    assert "Expected a key" in parse_error('{"a": "b",}')
+    assert "Expected a key" in parse_error('{"translations": {"a": "b",}}')
+
+
+def test_missing_comma():
+    assert "Expected ','" in parse_error('{"a": "b" "c": "d"}')
+
+
+def test_extra_data():
+    assert "Extra data" in parse_error('{"a": "b"} {}')
+
+
+def test_incomplete_document():
+    assert "Incomplete" in parse_error('{"a": "b"')
+
+
+def test_invalid_escape_is_reported_immediately():
+    message = parse_error('{"a": "\\q", ' + '"b": "c", ' * 100)
+    assert "Invalid \\escape" in message
+    assert "position 7" in message
+
+
+def test_invalid_escape_in_skipped_value():
+    message = parse_error('{"header": {"a": "\\q"}, "b": "c"')
+    assert "Invalid \\escape" in message
+
+
+def test_invalid_control_character():
+    assert "control character" in parse_error('{"a": "b\x01c", "d": "e"')
+
+
+def test_error_position_counts_consumed_chunks():
+    parser = TranslationParser()
+    parser.feed('{"a": "b", ')
+    with pytest.raises(ValueError, match="position 11"):
+        parser.feed("}")
+
+
+def test_too_long_value():
+    parser = TranslationParser()
+    parser.feed('{"a": "')
+    with pytest.raises(ValueError, match="Too long"):
+        parser.feed("x" * (MAX_BUFFERED_CHARS + 1))
@@ -1,23 +1,113 @@
 import json
-import re
+import tempfile
 from collections import defaultdict
 from pathlib import Path
+from typing import Callable
 
+import click
 import pytesseract
 from PIL import Image
 
-from common import OCR_RESULTS_FILE, get_screen_text_content
+from common import (
+    DATA_DIR,
+    FIGMA_DIR,
+    MODEL_FILE_MAPPING,
+    OCR_RESULTS_FILE,
+    map_models,
+)
+from models import MODEL_REGISTRY
+from screens import Screen, load_screens
 
+# Preprocessed images, reused until the screenshot changes
+OCR_CACHE_DIR = DATA_DIR / "ocr_cache"
 
-def get_text_from_image(image_path: str | Path) -> str:
-    image = Image.open(image_path)
+# How many images are processed by one tesseract invocation
+OCR_BATCH_SIZE = 200
 
-    # Optional: Preprocess the image (e.g., resize, thresholding)
+# Tesseract separates the pages (images from the list) by form feed
+PAGE_SEPARATOR = "\x0c"
+
+
+def _bicubic(image: Image.Image) -> Image.Image:
     # image = image.resize((256, 128), Image.BICUBIC)
-    image = image.resize((512, 256), Image.BICUBIC)
+    return image.resize((512, 256), Image.BICUBIC)
     # image = image.resize((1024, 512), Image.BICUBIC)
 
-    return pytesseract.image_to_string(image)
+
+def _nearest(image: Image.Image) -> Image.Image:
+    # Keeping the pixelated glyphs sharp
+    return image.resize((image.width * 4, image.height * 4), Image.NEAREST)
+
+
+def _nearest_threshold(image: Image.Image) -> Image.Image:
+    image = _nearest(image.convert("L"))
+    return image.point(lambda value: 255 if value > 127 else 0)
+
+
+PREPROCESSING: dict[str, Callable[[Image.Image], Image.Image]] = {
+    "bicubic": _bicubic,
+    "nearest": _nearest,
+    "nearest_threshold": _nearest_threshold,
+}
+
+OCR_PREPROCESSING = {
+    name: model.ocr_preprocessing for name, model in MODEL_REGISTRY.items()
+}
+
+
+def preprocess_image(image_path: Path, preprocessing: str) -> Path:
+    """Get the path of the preprocessed image, creating it when not cached."""
+    image_path = Path(image_path).resolve()
+    try:
+        relative_path = image_path.relative_to(FIGMA_DIR.resolve())
+    except ValueError:
+        relative_path = image_path.relative_to(image_path.anchor)
+    cached_path = OCR_CACHE_DIR / preprocessing / relative_path
+    if (
+        cached_path.exists()
+        and cached_path.stat().st_mtime >= image_path.stat().st_mtime
+    ):
+        return cached_path
+
+    cached_path.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(image_path) as image:
+        PREPROCESSING[preprocessing](image).save(cached_path)
+    return cached_path
+
+
+def get_text_from_image(image_path: str | Path, preprocessing: str = "bicubic") -> str:
+    return pytesseract.image_to_string(
+        str(preprocess_image(Path(image_path), preprocessing))
+    )
+
+
+def get_texts_from_images(
+    image_paths: list[Path], preprocessing: str = "bicubic"
+) -> list[str]:
+    """OCR of many images, processing a whole batch by one tesseract run.
+
+    Tesseract accepts a text file with the list of images and outputs
+    the texts of all of them, separated by a form feed.
+    """
+    texts: list[str] = []
+    for start in range(0, len(image_paths), OCR_BATCH_SIZE):
+        batch = [
+            preprocess_image(path, preprocessing)
+            for path in image_paths[start : start + OCR_BATCH_SIZE]
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as list_file:
+            list_file.write("\n".join(str(path) for path in batch) + "\n")
+            list_file.flush()
+            output = pytesseract.image_to_string(list_file.name)
+
+        # Keeping the separator, as it is in the output of a single image
+        pages = [page + PAGE_SEPARATOR for page in output.split(PAGE_SEPARATOR)[:-1]]
+        if len(pages) == len(batch):
+            texts.extend(pages)
+        else:
+            # Could not match the output to the images, doing it one by one
+            texts.extend(pytesseract.image_to_string(str(path)) for path in batch)
+    return texts
 
 
 def length_penalty(text1: str, text2: str) -> float:
@@ -36,47 +126,70 @@ def jaccard_similarity(text1: str, text2: str) -> float:
     return similarity * penalty
 
 
-def generate_report() -> None:
-    res: dict[str, dict[str, int]] = defaultdict(dict)
+def get_similarity(screen: Screen, extracted_text: str) -> float:
+    """Compare the main text of the screen description with the OCR output."""
+    split = extracted_text.split("\n")
+    if split[-1] == PAGE_SEPARATOR:
+        split = split[:-1]
+    if screen.has_title:
+        split = split[1:]
+    if screen.has_buttons:
+        split = split[:-1]
+
+    extracted_text = " ".join(split)
+
+    return jaccard_similarity(extracted_text, screen.body)
 
-    screens_content = get_screen_text_content()
-    for flow_name, flow_data in screens_content.items():
-        for index, screen_info in enumerate(flow_data, start=1):
-            description = screen_info["description"]
-            img_name = f"{flow_name}{index}"
-            img_src = Path(f"static/{flow_name}/{img_name}.png")
-            if not img_src.exists():
-                continue
-            extracted_text = get_text_from_image(img_src)
-
-            # remove all the content of {xxx} and [xxx] from description
-            description = re.sub(r"\{.*?\}", "", description)
-            description = re.sub(r"\[.*?\]", "", description)
-
-            try:
-                main_text = description.split("||")[-2].strip()
-            except IndexError:
-                main_text = description
-
-            potential_title = description.split("||")[0].strip()
-            has_title = potential_title and potential_title.upper() == potential_title
-            has_buttons = "<" in description and ">" in description
-
-            split = extracted_text.split("\n")
-            if split[-1] == "\x0c":
-                split = split[:-1]
-            if has_title:
-                split = split[1:]
-            if has_buttons:
-                split = split[:-1]
-
-            extracted_text = " ".join(split)
-
-            similarity = jaccard_similarity(extracted_text, main_text)
-            res[flow_name][img_name] = int(similarity * 100)
+
+def score_model(
+    model: str, preprocessing: str | None = None
+) -> dict[str, dict[str, int]]:
+    screens = [
+        screen
+        for screen in load_screens(model)
+        if (FIGMA_DIR / screen.img_path).exists()
+    ]
+
+    model_preprocessing = preprocessing or OCR_PREPROCESSING[model]
+    extracted_texts = get_texts_from_images(
+        [FIGMA_DIR / screen.img_path for screen in screens], model_preprocessing
+    )
+    res: dict[str, dict[str, int]] = defaultdict(dict)
+    for screen, extracted_text in zip(screens, extracted_texts):
+        similarity = get_similarity(screen, extracted_text)
+        res[screen.flow_name][screen.name] = int(similarity * 100)
+    return res
+
+
+def generate_report(models: list[str], preprocessing: str | None = None) -> None:
+    results: dict[str, dict[str, dict[str, int]]] = {}
+    if OCR_RESULTS_FILE.exists():
+        # Results of other models are kept, files with results not keyed
+        # by model (before models were separated) are dropped
+        results = {
+            model: model_results
+            for model, model_results in json.loads(OCR_RESULTS_FILE.read_text()).items()
+            if model in MODEL_FILE_MAPPING
+        }
+
+    # Models are processed by parallel tesseract processes
+    model_results = map_models(lambda model: score_model(model, preprocessing), models)
+    for model, res in zip(models, model_results):
+        results[model] = res
+        count = sum(len(flow) for flow in res.values())
+        click.echo(f"OCR of {count} screens of model {model}")
 
     with open(OCR_RESULTS_FILE, "w") as f:
-        json.dump(res, f, indent=4)
+        json.dump(results, f, indent=4)
+
+
+@click.command()
+# fmt: off
+@click.option("-p", "--preprocessing", type=click.Choice(list(PREPROCESSING)), help="Override the preprocessing of all models")
+@click.argument("models", nargs=-1, type=click.Choice(list(MODEL_FILE_MAPPING.keys())))
+# fmt: on
+def cli(preprocessing: str | None, models: tuple[str, ...]):
+    generate_report(list(models) or list(MODEL_FILE_MAPPING.keys()), preprocessing)
 
 
 if __name__ == "__main__":
@@ -84,4 +197,4 @@ if __name__ == "__main__":
     # extracted_text = get_text_from_image(image_path)
     # print(extracted_text)
 
-    generate_report()
+    cli()
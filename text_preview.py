@@ -0,0 +1,147 @@
+"""
+Rendering of the assembled translation lines into device-sized bitmaps.
+
+Every glyph occupies exactly its advance width from `font_widths.json`,
+so the previews are pixel-accurate in terms of the line layout. The shapes
+of the glyphs come from the built-in PIL bitmap font scaled into the glyph
+cell, as the device fonts themselves are not available here.
+"""
+
+from __future__ import annotations
+
+import base64
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from models import DEVICE_REGISTRY
+from validate_strings import FONT_MAPPING, FONTS, SCREEN_TEXT_WIDTHS, get_layout
+
+# Unknown glyphs have the same fallback width as in `get_text_width`
+FALLBACK_GLYPH_WIDTH = 8
+
+# Pixel values of the rendered bitmap, indexes into the palette
+BACKGROUND, OVERFLOW, EDGE, TEXT = range(4)
+PALETTE = np.array(
+    [
+        [0, 0, 0],  # background
+        [120, 0, 0],  # area outside of the screen
+        [0, 90, 160],  # right edge of the text area
+        [255, 255, 255],  # text
+    ],
+    dtype=np.uint8,
+)
+
+PREVIEW_CACHE_SIZE = 4096
+
+_BASE_FONT = ImageFont.load_default()
+_BASE_CELL_SIZE = (16, 12)
+
+
+@lru_cache(maxsize=None)
+def _get_base_rows() -> slice:
+    """Rows of the base font cell used by any glyph, from ascenders to descenders."""
+    img = Image.new("L", _BASE_CELL_SIZE)
+    ImageDraw.Draw(img).text((0, 0), "AÉgjpqy|", font=_BASE_FONT, fill=255)
+    ink_rows = np.flatnonzero((np.asarray(img) > 0).any(axis=1))
+    return slice(ink_rows[0], ink_rows[-1] + 1)
+
+
+@lru_cache(maxsize=None)
+def _get_base_glyph(char: str, bold: bool) -> np.ndarray:
+    """Bitmap of the char in the base font, cropped horizontally to its ink."""
+    img = Image.new("L", _BASE_CELL_SIZE)
+    draw = ImageDraw.Draw(img)
+    draw.text((0, 0), char, font=_BASE_FONT, fill=255)
+    if bold:
+        draw.text((1, 0), char, font=_BASE_FONT, fill=255)
+    glyph = (np.asarray(img) > 0)[_get_base_rows()]
+    ink_columns = np.flatnonzero(glyph.any(axis=0))
+    if not ink_columns.size:
+        return glyph[:, :0]
+    return glyph[:, ink_columns[0] : ink_columns[-1] + 1]
+
+
+@lru_cache(maxsize=None)
+def get_glyph(char: str, font: str, device: str) -> np.ndarray:
+    """Boolean bitmap of the glyph, as wide as its advance and as high as the font."""
+    geometry = DEVICE_REGISTRY[device]
+    advance = FONTS[device][font].get(char, FALLBACK_GLYPH_WIDTH)
+    cell = np.zeros((geometry.glyph_height, advance), dtype=bool)
+    base_glyph = _get_base_glyph(char, font == "bold")
+    # Leaving one column for the spacing between glyphs
+    ink_width = max(advance - 1, 1)
+    if base_glyph.shape[1] and advance:
+        # Nearest neighbour scaling of the base glyph into the cell
+        rows = np.arange(geometry.glyph_height) * base_glyph.shape[0]
+        cols = np.arange(ink_width) * base_glyph.shape[1]
+        scaled = base_glyph[
+            (rows // geometry.glyph_height)[:, None],
+            (cols // ink_width)[None, :],
+        ]
+        cell[:, :ink_width] = scaled
+    cell.setflags(write=False)
+    return cell
+
+
+def render_line(line: str, type: str, device: str) -> np.ndarray:
+    font = FONT_MAPPING[device][type]
+    geometry = DEVICE_REGISTRY[device]
+    if not line:
+        return np.zeros((geometry.glyph_height, 0), dtype=bool)
+    return np.hstack([get_glyph(char, font, device) for char in line])
+
+
+def render_bitmap(text: str, type: str, device: str) -> np.ndarray:
+    """Render the text as it would be laid out on the device screen.
+
+    Returns an array of palette indexes at device resolution. When the text
+    needs more lines than fit on the screen, the bitmap is extended downwards
+    and the overflowing area has a different background.
+    """
+    geometry = DEVICE_REGISTRY[device]
+    text_width = SCREEN_TEXT_WIDTHS[device]
+    layout = get_layout(text, type, device)
+    line_bitmaps = [render_line(line, type, device) for line in layout.lines]
+
+    width = max(geometry.width, geometry.margin + max(layout.widths, default=0))
+    height = max(geometry.height, len(layout.lines) * geometry.line_height)
+
+    bitmap = np.full((height, width), BACKGROUND, dtype=np.uint8)
+    bitmap[geometry.height :, :] = OVERFLOW
+    bitmap[:, geometry.width :] = OVERFLOW
+    edge = geometry.margin + text_width
+    if edge < width:
+        bitmap[:, edge] = EDGE
+
+    top_padding = geometry.line_height - geometry.glyph_height
+    left = geometry.margin
+    for index, line_bitmap in enumerate(line_bitmaps):
+        top = index * geometry.line_height + top_padding
+        area = bitmap[
+            top : top + line_bitmap.shape[0], left : left + line_bitmap.shape[1]
+        ]
+        area[line_bitmap] = TEXT
+    return bitmap
+
+
+def render_text(text: str, type: str, device: str) -> np.ndarray:
+    """Render the text into an RGB array, see `render_bitmap`."""
+    return PALETTE[render_bitmap(text, type, device)]
+
+
+@lru_cache(maxsize=PREVIEW_CACHE_SIZE)
+def render_preview_png(text: str, type: str, device: str) -> bytes:
+    img = Image.fromarray(render_bitmap(text, type, device), mode="P")
+    img.putpalette(PALETTE.tobytes())
+    buffer = BytesIO()
+    img.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def get_preview_data_uri(text: str, type: str, device: str) -> str:
+    """Preview as a `data:` URI, to be used directly in the `img` tag."""
+    png_bytes = render_preview_png(text, type, device)
+    return "data:image/png;base64," + base64.b64encode(png_bytes).decode()
@@ -1,7 +1,13 @@
+from __future__ import annotations
+
 import json
 from dataclasses import dataclass
+from functools import lru_cache
+from math import ceil
 from pathlib import Path
 
+from models import DEVICE_REGISTRY, DeviceConfig, ModelConfigError
+
 HERE = Path(__file__).parent
 
 
@@ -19,10 +25,19 @@ class TooLong:
         return f"{self.key}: {self.value} --- {self.en} ({len(self.lines)} / {len(self.lines_en)})"
 
     def lines_str(self) -> str:
-        return "\n".join(fill_lines_till_end(self.lines, self.type, self.model))
+        return "\n".join(get_layout(self.value, self.type, self.model).padded)
 
     def lines_en_str(self) -> str:
-        return "\n".join(fill_lines_till_end(self.lines_en, self.type, self.model))
+        return "\n".join(get_layout(self.en, self.type, self.model).padded)
+
+
+@dataclass(frozen=True)
+class Layout:
+    """Text assembled into screen lines, shared between requests."""
+
+    lines: tuple[str, ...]
+    widths: tuple[int, ...]
+    padded: tuple[str, ...]
 
 
 altcoins = [
@@ -39,29 +54,47 @@ altcoins = [
 ]
 
 
-SCREEN_TEXT_WIDTHS = {"TT": 240 - 12, "TS3": 128}
-MAX_BUTTON_WIDTH = {"TT": 162, "TS3": 88}
-
-FONT_MAPPING = {
-    "TT": {
-        "title": "bold",
-        "text": "normal",
-        "bold": "bold",
-        "button": "bold",
-    },
-    "TS3": {
-        "title": "bold",
-        "text": "normal",
-        "bold": "bold",
-        "button": "normal",
-    },
+SCREEN_TEXT_WIDTHS = {
+    name: device.text_width for name, device in DEVICE_REGISTRY.items()
+}
+MAX_BUTTON_WIDTH = {
+    name: device.max_button_width for name, device in DEVICE_REGISTRY.items()
 }
 
-DEVICES = ["TT", "TS3"]
+FONT_MAPPING = {name: device.fonts for name, device in DEVICE_REGISTRY.items()}
+
+DEVICES = list(DEVICE_REGISTRY)
 
 FONTS_FILE = HERE / "font_widths.json"
 
-FONTS: dict[str, dict[str, dict[str, int]]] = json.loads(FONTS_FILE.read_text())
+
+def get_device_fonts(
+    device: DeviceConfig, tables: dict[str, dict[str, dict[str, int]]]
+) -> dict[str, dict[str, int]]:
+    """Width tables of the device's fonts, checking all of them are defined."""
+    where = f"device {device.name}"
+    fonts = tables.get(device.font_table)
+    if fonts is None:
+        raise ModelConfigError(
+            f"{where}: no font table '{device.font_table}' in {FONTS_FILE.name}"
+        )
+    for font in device.fonts.values():
+        if font not in fonts:
+            raise ModelConfigError(
+                f"{where}: no font '{font}' in table '{device.font_table}'"
+            )
+    return fonts
+
+
+_font_tables = json.loads(FONTS_FILE.read_text())
+# device -> font -> character widths
+FONTS: dict[str, dict[str, dict[str, int]]] = {
+    name: get_device_fonts(device, _font_tables)
+    for name, device in DEVICE_REGISTRY.items()
+}
+
+# The same texts recur across keys, languages and submissions
+LAYOUT_CACHE_SIZE = 8192
 
 
 def will_fit(text: str, type: str, device: str, lines: int) -> bool:
@@ -73,7 +106,15 @@ def will_fit(text: str, type: str, device: str, lines: int) -> bool:
 
 
 def get_needed_lines(text: str, type: str, device: str) -> int:
-    return len(assemble_lines(text, type, device))
+    return len(get_layout(text, type, device).lines)
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_layout(text: str, type: str, device: str) -> Layout:
+    lines = assemble_lines(text, type, device)
+    widths = [get_text_width(line, type, device) for line in lines]
+    padded = [pad_line(line, width, type, device) for line, width in zip(lines, widths)]
+    return Layout(lines=tuple(lines), widths=tuple(widths), padded=tuple(padded))
 
 
 def assemble_lines(text: str, type: str, device: str) -> list[str]:
@@ -109,23 +150,20 @@ def assemble_lines(text: str, type: str, device: str) -> list[str]:
     return assembled_lines
 
 
-def fill_lines_till_end(lines: list[str], type: str, device: str) -> list[str]:
-    filled_lines: list[str] = []
-    screen_width = SCREEN_TEXT_WIDTHS[device]
-
-    for line in lines:
-        if_first = True
-        line_width = get_text_width(line, type, device)
-        while line_width < screen_width:
-            if if_first:
-                if_first = False
-                line += " "
-            else:
-                line += "*"
-            line_width = get_text_width(line, type, device)
-        filled_lines.append(line[:-1])
+def pad_line(line: str, line_width: int, type: str, device: str) -> str:
+    """Fill the line with a space and asterisks to show the remaining screen width.
 
-    return filled_lines
+    The last character is cut, so the result is never wider than the screen.
+    """
+    screen_width = SCREEN_TEXT_WIDTHS[device]
+    if line_width >= screen_width:
+        return line[:-1]
+    line_width += get_text_width(" ", type, device)
+    if line_width >= screen_width:
+        return line
+    asterisk_width = get_text_width("*", type, device)
+    asterisks = ceil((screen_width - line_width) / asterisk_width)
+    return line + " " + "*" * (asterisks - 1)
 
 
 def get_text_width(text: str, type: str, device: str) -> int:
@@ -134,53 +172,76 @@ def get_text_width(text: str, type: str, device: str) -> int:
     return sum(widths.get(c, 8) for c in text)
 
 
-def check_translations(translation_content: dict[str, str]) -> list[TooLong]:
+class MissingRuleError(ValueError):
+    pass
+
+
+def get_en_content() -> dict[str, str]:
     en_file = HERE / "en.json"
-    en_content = json.loads(en_file.read_text())["translations"]
+    return json.loads(en_file.read_text())["translations"]
+
 
+def get_rules_content() -> dict[str, str]:
     rules_file = HERE / "rules.json"
-    rules_content = json.loads(rules_file.read_text())
+    return json.loads(rules_file.read_text())
 
-    translation_content = {
-        k: v.replace(" (TODO)", "") for k, v in translation_content.items()
-    }
-    translation_content = {
-        k: v.replace(" (TOO LONG)", "") for k, v in translation_content.items()
-    }
 
-    wrong: dict[str, TooLong] = {}
+def check_translation(
+    k: str, v: str, en_content: dict[str, str], rules_content: dict[str, str]
+) -> TooLong | None:
+    """Check a single translation on all devices.
 
-    for k, v in list(translation_content.items())[:]:
-        if k.split("__")[0] in altcoins:
-            continue
-        if k.split("__")[0] == "plurals":
+    Returns the result from the last device on which the text does not fit.
+    """
+    v = v.replace(" (TODO)", "").replace(" (TOO LONG)", "")
+
+    if k.split("__")[0] in altcoins:
+        return None
+    if k.split("__")[0] == "plurals":
+        return None
+
+    rule = rules_content.get(k)
+    if not rule:
+        raise MissingRuleError(f"Missing rule for {k}")
+    type, lines = rule.split(",")
+    lines = int(lines)
+
+    too_long: TooLong | None = None
+    for model in DEVICES:
+        if k.startswith(DEVICE_REGISTRY[model].skip_translations):
             continue
 
-        rule = rules_content.get(k)
-        if not rule:
-            print(f"Missing rule for {k}")
+        if not will_fit(v, type, model, lines):
+            en_value = en_content.get(k, "MISSING")
+            too_long = TooLong(
+                model=model,
+                type=type,
+                key=k,
+                value=v,
+                lines=list(get_layout(v, type, model).lines),
+                en=en_value,
+                lines_en=list(get_layout(en_value, type, model).lines),
+            )
+
+    return too_long
+
+
+def check_translations(translation_content: dict[str, str]) -> list[TooLong]:
+    en_content = get_en_content()
+    rules_content = get_rules_content()
+
+    wrong: list[TooLong] = []
+
+    for k, v in translation_content.items():
+        try:
+            too_long = check_translation(k, v, en_content, rules_content)
+        except MissingRuleError as e:
+            print(e)
             continue
-        type, lines = rule.split(",")
-        lines = int(lines)
-
-        for model in DEVICES:
-            if model == "TT" and k.startswith("tutorial"):
-                continue
-
-            if not will_fit(v, type, model, lines):
-                en_value = en_content.get(k, "MISSING")
-                too_long = TooLong(
-                    model=model,
-                    type=type,
-                    key=k,
-                    value=v,
-                    lines=assemble_lines(v, type, model),
-                    en=en_value,
-                    lines_en=assemble_lines(en_value, type, model),
-                )
-                wrong[k] = too_long
-
-    return list(wrong.values())
+        if too_long is not None:
+            wrong.append(too_long)
+
+    return wrong
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+"""
+Scoring how much the screenshots match the screens exported from Figma.
+
+References are expected in `figma_export/<model>/<flow>/<screen>.png`
+(see `resizer.py`), they are downscaled to the screenshot resolution
+with NEAREST. All the screens of the same size are compared in batches
+as NumPy arrays - SSIM with a uniform window and mean pixel error.
+
+Results are saved per model, flow and screen into `visual_results.json`.
+"""
+
+from __future__ import annotations
+
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator
+
+import click
+import numpy as np
+from PIL import Image
+
+from common import (
+    FIGMA_DIR,
+    FIGMA_EXPORT_DIR,
+    MODEL_FILE_MAPPING,
+    VISUAL_RESULTS_FILE,
+    map_models,
+)
+from resizer import resize_to_screen
+from screens import load_screens
+
+BATCH_SIZE = 256
+SSIM_WINDOW = 7
+SSIM_C1 = 0.01**2
+SSIM_C2 = 0.03**2
+
+
+def load_gray(path: Path, size: tuple[int, int] | None = None) -> np.ndarray:
+    with Image.open(path) as img:
+        img = img.convert("L")
+        if size is not None:
+            img = resize_to_screen(img, size)
+        return np.asarray(img, dtype=np.float32) / 255
+
+
+def box_mean(images: np.ndarray, window: int) -> np.ndarray:
+    """Mean over all the `window x window` areas, for a batch of images (N, H, W)."""
+    integral = np.pad(images.cumsum(axis=1).cumsum(axis=2), ((0, 0), (1, 0), (1, 0)))
+    sums = (
+        integral[:, window:, window:]
+        - integral[:, :-window, window:]
+        - integral[:, window:, :-window]
+        + integral[:, :-window, :-window]
+    )
+    return sums / (window * window)
+
+
+def ssim(x: np.ndarray, y: np.ndarray, window: int = SSIM_WINDOW) -> np.ndarray:
+    """Mean structural similarity of each pair of images in the batches (N, H, W)."""
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    mu_x = box_mean(x, window)
+    mu_y = box_mean(y, window)
+    var_x = box_mean(x * x, window) - mu_x * mu_x
+    var_y = box_mean(y * y, window) - mu_y * mu_y
+    cov_xy = box_mean(x * y, window) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * cov_xy + SSIM_C2)) / (
+        (mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2)
+    )
+    return ssim_map.mean(axis=(1, 2))
+
+
+def pixel_error(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Mean absolute difference of each pair of images in the batches (N, H, W)."""
+    return np.abs(x - y).mean(axis=(1, 2))
+
+
+def iter_screen_pairs(model: str) -> Iterator[tuple[str, str, Path, Path]]:
+    """Yield (flow_name, img_name, screenshot, reference) for all comparable screens."""
+    for screen in load_screens(model):
+        if screen.missing:
+            continue
+        screenshot = FIGMA_DIR / screen.img_path
+        reference = FIGMA_EXPORT_DIR / screen.img_path
+        if screenshot.exists() and reference.exists():
+            yield screen.flow_name, screen.name, screenshot, reference
+
+
+def score_model(model: str) -> dict[str, dict[str, int]]:
+    """Get the score (0-100) of every screen, which has its Figma reference."""
+    # Batches need images of the same size, only the headers are read here
+    by_size: dict[tuple[int, int], list[tuple[str, str, Path, Path]]] = defaultdict(
+        list
+    )
+    for flow_name, img_name, screenshot, reference in iter_screen_pairs(model):
+        with Image.open(screenshot) as img:
+            size = img.size
+        by_size[size].append((flow_name, img_name, screenshot, reference))
+
+    res: dict[str, dict[str, int]] = defaultdict(dict)
+    for (width, height), screens in by_size.items():
+        for start in range(0, len(screens), BATCH_SIZE):
+            batch = screens[start : start + BATCH_SIZE]
+            screenshots = np.stack([load_gray(screen[2]) for screen in batch])
+            references = np.stack(
+                [load_gray(screen[3], (width, height)) for screen in batch]
+            )
+            if min(height, width) >= SSIM_WINDOW:
+                scores = ssim(screenshots, references)
+            else:
+                scores = 1 - pixel_error(screenshots, references)
+            for (flow_name, img_name, _, _), score in zip(batch, scores):
+                res[flow_name][img_name] = int(np.clip(score, 0, 1) * 100)
+    return dict(res)
+
+
+def generate_report(models: list[str]) -> None:
+    results: dict[str, dict[str, dict[str, int]]] = {}
+    if VISUAL_RESULTS_FILE.exists():
+        results = json.loads(VISUAL_RESULTS_FILE.read_text())
+    for model, model_results in zip(models, map_models(score_model, models)):
+        results[model] = model_results
+        count = sum(len(flow) for flow in results[model].values())
+        click.echo(f"Scored {count} screens of model {model}")
+    with open(VISUAL_RESULTS_FILE, "w") as f:
+        json.dump(results, f, indent=4)
+
+
+@click.command()
+@click.argument("models", nargs=-1, type=click.Choice(list(MODEL_FILE_MAPPING.keys())))
+def cli(models: tuple[str, ...]):
+    generate_report(list(models) or list(MODEL_FILE_MAPPING.keys()))
+
+
+if __name__ == "__main__":
+    cli()